@@ -1,53 +1,136 @@
-from common.utils import generate_cover_letter_pdf, load_json_file, write_json_file
-from sentence_transformers import SentenceTransformer
+from common.utils import generate_cover_letter_pdf
+from common.state_store import open_state_store
+from common.llm_cache import LLMCache
 from integrations.mail_handler import MailClient
-from integrations.seek_client import SeekClient
-from scipy.spatial.distance import cosine
+from integrations.seek_client import AsyncSeekClient
+from integrations.email_templates import EmailTemplates
+from common.rate_limiter import RateLimiter
 from scrapers.scraper import JobScraper
-from integrations.agent import AIAgent
-from datetime import datetime
+from integrations.agent import AIAgent, UsageLog
+from datetime import datetime, timedelta
+from pathlib import Path
+import hashlib
+import shutil
 import logging
-import time
+import asyncio
+import html
+import os
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
 )
 
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+DIGEST_PENDING_KEY = 'ufl_digest_pending'
+DIGEST_LAST_SENT_KEY = 'ufl_digest_last_sent'
+SEEK_WATERMARKS_KEY = 'seek_watermarks'
+
 class ApplicationPipeline:
     def __init__(self, run_config, args):
-        self.scraper = JobScraper(run_config)
+        self.scraper = JobScraper(run_config, args.http_cache_path)
         self.args = args
         self.source = run_config.get("source", "seek")
         self.mode = run_config.get("mode", "apply")
+        self.digest = run_config.get("digest", {})
         self.agent = None
-        self.mail_client = MailClient(args.mail_protocol)
-        self.applied = self._load_applied(args.applied_path)
+        self.email_templates = None
+        self.rate_limiter = RateLimiter(run_config.get("rate_limits"))
+        self._mail_client = None
+        self._state = None
         self.model = None
+        self.embedding_cache = None
         self.encoded_resume_txt = None
+        self.job_slots = asyncio.Semaphore(args.workers)
+        self.llm_slots = asyncio.Semaphore(args.llm_concurrency)
+        self.seek_slots = asyncio.Semaphore(args.seek_concurrency)
+        self.smtp_slots = asyncio.Semaphore(args.smtp_concurrency)
+        self.in_progress = set()
+        self.emails_in_progress = set()
+        # Search terms overlap, each job id is only scored once per run
+        self.seen_job_ids = set()
+        self.llm_cache = None
         if self.source != "ufl":
-            self.agent = AIAgent(args.first_name, args.model).agent
-            self.model = SentenceTransformer('all-MiniLM-L6-v2')
-            self.encoded_resume_txt = self.model.encode(self.args.resume_txt, convert_to_numpy=True)
+            # Imported here so UF notify runs never load numpy
+            from common.embedding_cache import EmbeddingCache
+
+            if args.llm_cache:
+                self.llm_cache = LLMCache(args.llm_cache_path, args.llm_cache_ttl_days, args.llm_cache_size)
+            self.agent = AIAgent(
+                args.first_name, args.model, self.rate_limiter, UsageLog(args.llm_usage_path), args.single_pass, self.llm_cache
+            ).agent
+            self.email_templates = EmailTemplates(args.email_templates_path, args.email_variants)
+            self.embedding_cache = EmbeddingCache(args.embedding_cache_dir, EMBEDDING_MODEL, args.embedding_cache_size)
+            self.encoded_resume_txt = self.embed([self.args.resume_txt])[0]
+            self.embedding_cache.flush()
+
+    # State and mail are opened on first use so an unchanged UF listing never touches either
+    @property
+    def state(self):
+        if self._state is None:
+            self._state = open_state_store(self.args.state_backend, self.args.state_path, self.args.applied_path)
+        return self._state
 
-    def _load_applied(self, path):
-        applied = load_json_file(path)
-        if not applied:
-            return {'jobs': {}, 'email_history': {}}
-        
-        return applied
+    @property
+    def mail_client(self):
+        if self._mail_client is None:
+            self._mail_client = MailClient(self.args.mail_protocol, self.rate_limiter["smtp"], self.args.smtp_concurrency)
+        return self._mail_client
 
-    def calculate_resume_jd_similarity(self, jd_text):
-        if not self.model or not self.encoded_resume_txt:
-            return 0.0
-        jd_vector = self.model.encode(jd_text, convert_to_numpy=True)
-        sim_score = 1 - cosine(self.encoded_resume_txt, jd_vector)
+    def embed(self, texts):
+        import numpy as np
 
-        return float(sim_score)
+        # The model is only loaded when some text is missing from the cache
+        vectors = self.embedding_cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            if self.model is None:
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(EMBEDDING_MODEL)
+            missing_texts = [texts[i] for i in missing]
+            encoded = self.model.encode(
+                missing_texts,
+                batch_size=self.args.embed_batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+            self.embedding_cache.put_many(missing_texts, encoded)
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        logging.info(f"Embedded {len(texts)} texts, {len(texts) - len(missing)} from cache")
+        return np.stack(vectors)
+
+    def _job_description(self, job):
+        return " ".join(job.get('content', {}).get('sections') or [])
+
+    def _content_hash(self, job):
+        # A rejection only holds for the same ad scored against the same resume and model
+        key = f"{EMBEDDING_MODEL}\0{self.args.resume_txt}\0{self._job_description(job)}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def score_jobs(self, jobs):
+        scorable = []
+        descriptions = []
+        for job in jobs:
+            job_description = self._job_description(job)
+            if not job_description:
+                logging.error(f"No job description found for job {job.get('id')}, unable to process job, skipping.")
+                continue
+            scorable.append(job)
+            descriptions.append(job_description)
+
+        if self.embedding_cache is None or not scorable:
+            return []
+
+        # Embeddings are unit length so one matrix-vector product gives every cosine similarity
+        jd_vectors = self.embed(descriptions)
+        self.embedding_cache.flush()
+        scores = jd_vectors @ self.encoded_resume_txt
+        return [(job, float(score)) for job, score in zip(scorable, scores)]
 
     def should_skip_email(self, email):
-        if email in self.applied['email_history']:
-            last_contacted = datetime.fromisoformat(self.applied['email_history'][email]['last_contacted'])
+        last_contacted = self.state.last_contacted(email)
+        if last_contacted:
             days_since_contact = (datetime.now() - last_contacted).days
             if days_since_contact < 7:
                 logging.info(f"Recently contacted {email} {days_since_contact} days ago, skipping.")    
@@ -55,116 +138,208 @@ class ApplicationPipeline:
         return False
 
     async def run(self):
-        if self.source == "ufl":
-            await self._run_ufl_notifications()
-            return
+        try:
+            if self.source == "ufl":
+                await self._run_ufl_notifications()
+            else:
+                await self._run_applications()
+        finally:
+            if self._mail_client:
+                self._mail_client.close()
+            if self._state:
+                self._state.close()
+            if self.llm_cache:
+                self.llm_cache.close()
+
+    async def _run_applications(self):
         logging.info("Scraping job listings...")
-        data = await self.scraper.scrape("websift/seek-job-scraper")
-        with SeekClient(self.mail_client) as seek_client:
-            for searchTerm, job_data in data.items():
-                if not job_data:
-                    logging.info(f'No jobs found for search term: {searchTerm}, exiting.')
-                    continue
+        async with AsyncSeekClient(self.mail_client, self.rate_limiter["seek"]) as seek_client:
+            tasks = []
+            # Dataset pages arrive as each search term's run finishes, jobs start while other runs are still scraping
+            watermarks = self.state.get_meta(SEEK_WATERMARKS_KEY, {})
+            async for searchTerm, job_data in self.scraper.stream("websift/seek-job-scraper", watermarks):
                 logging.info(f"Found {len(job_data)} jobs for search term: {searchTerm}")
 
-                for job in job_data:
-                    try:
-                        job_id = job['id']
-                        logging.info(f"Processing job: {job_id}")
-                        if job_id in self.applied['jobs']:
-                            logging.info(f"Already applied to job {job_id}, skipping.")
-                            continue
-                        # Re init agent if using meta ai to avoid limit context window issues
-                        if not self.args.use_openai:
-                            self.agent = AIAgent(self.args.first_name).agent
-                        
-                        position = job.get('title', '')
-                        raw_content = job.get('content', {})
-                        job_description = raw_content.get('sections')
-                        if not job_description:
-                            logging.error("No job description found, unable to process job, skipping.")
-                            continue
-                        
-                        score = self.calculate_resume_jd_similarity(" ".join(job_description))
-                        if score < self.args.min_score:
-                            logging.info(f"Low similarity score {score} for job {job_id}, skipping.")
-                            continue
-                        
-                        seek_success = False
-                        email_success = False
-                        emails_contacted = []
-
-                        cover_letter = self.agent.prepare_cover_letter(job, self.args.resume_txt, self.args.australian_language)
-                        generate_cover_letter_pdf(cover_letter, self.args.cover_letter_path)
-
-                        # Skip over jobs that require questions to be answered
-                        if seek_client.is_logged_in and (not job['hasRoleRequirements'] and not job['isExternalApply']):
-                            success = seek_client.apply(job_id, resume_path=self.args.resume_pdf_path, cover_letter_path=self.args.cover_letter_path, show_recent_role=self.args.show_recent_role)
-                            if success:
-                                logging.info(f"successfully applied to job {job_id} via seek")
-                                seek_success = True
-
-                            
-                        for email in job['emails']:
-                            if self.should_skip_email(email):
-                                continue
-
-                            msg = self.agent.write_email_contents()
-
-                            success = self.mail_client.send_application(
-                                email,
-                                job,
-                                msg,
-                                self.args.resume_pdf_path,
-                                self.args.cover_letter_path
-                            )
-                            if success:
-                                email_success = True
-                                emails_contacted.append(email)
-                                if email in self.applied['email_history']:
-                                    self.applied['email_history'][email]['last_contacted'] = datetime.now().isoformat()
-                                    self.applied['email_history'][email]['jobs_contacted'].append(job_id)
-                                else:
-                                    self.applied['email_history'][email] = {
-                                        'last_contacted': datetime.now().isoformat(),
-                                        'jobs_contacted': [job_id]
-                                    }
-                        
-                        self.applied['jobs'][job_id] = {
-                            'applied_on': datetime.now().isoformat(),
-                            'similarity_score': score,
-                            'applied_via_seek': seek_success,
-                            'applied_via_email': email_success,
-                            'emails_contacted': emails_contacted,
-                            'position': position,
-                            'link': job.get('jobLink', '')
-                        }
-
-                        write_json_file(self.args.applied_path, self.applied)
-                    except Exception as e:
-                        logging.error(f"Error processing job application: {e}")
-
-                    # Wait 30sec to not overload api can be removed if using official apis
-                    if not self.args.use_openai:
-                        logging.info('sleeping')
-                        time.sleep(30)
+                new_jobs = self._dedup_jobs(job_data)
+                scored_jobs = await asyncio.to_thread(self.score_jobs, new_jobs)
+                matches = []
+                rejected = {}
+                for job, score in scored_jobs:
+                    if score < self.args.min_score:
+                        logging.info(f"Low similarity score {score} for job {job['id']}, skipping.")
+                        rejected[job['id']] = {'score': score, 'content_hash': self._content_hash(job)}
+                        continue
+                    matches.append((job, score))
+                if rejected:
+                    self.state.record_rejections(rejected)
+                logging.info(f"Shortlisted {len(matches)} of {len(job_data)} jobs for search term: {searchTerm}")
+
+                # Jobs overlap their network waits, bounded by --workers and the per stage limits
+                tasks.extend((searchTerm, asyncio.create_task(self._process_job(job, score, seek_client))) for job, score in matches)
+
+            results = await asyncio.gather(*(task for _, task in tasks))
+            # A failed job isn't recorded, its search term keeps the old watermark so the next run retries it.
+            # Saved only after every shortlisted job was handled, a crashed run scrapes the same listings again.
+            for (searchTerm, _), handled in zip(tasks, results):
+                if not handled:
+                    self.scraper.hold_watermark(searchTerm)
+            self.state.set_meta(SEEK_WATERMARKS_KEY, self.scraper.watermarks)
+
+    def _dedup_jobs(self, job_data):
+        new_jobs = []
+        duplicates = 0
+        previously_rejected = 0
+        for job in job_data:
+            job_id = job.get('id')
+            if job_id in self.seen_job_ids:
+                duplicates += 1
+                continue
+            self.seen_job_ids.add(job_id)
+            if self.state.is_applied(job_id):
+                continue
+            # Rejected ads are skipped until their content changes or --min_score drops below their score
+            rejection = self.state.get_rejection(job_id)
+            if rejection and rejection['score'] < self.args.min_score and rejection['content_hash'] == self._content_hash(job):
+                previously_rejected += 1
+                continue
+            new_jobs.append(job)
+        if duplicates or previously_rejected:
+            logging.info(f"Skipped {duplicates} jobs already seen under another search term and {previously_rejected} previously rejected jobs")
+        return new_jobs
+
+    async def _process_job(self, job, score, seek_client):
+        job_id = job.get('id')
+        logging.info(f"Processing job: {job_id}")
+        if self.state.is_applied(job_id) or job_id in self.in_progress:
+            logging.info(f"Already applied to job {job_id}, skipping.")
+            return True
+
+        self.in_progress.add(job_id)
+        try:
+            async with self.job_slots:
+                return await self._apply_to_job(job, score, seek_client)
+        finally:
+            self.in_progress.discard(job_id)
+
+    async def _apply_to_job(self, job, score, seek_client):
+        cover_letter_path = None
+        try:
+            job_id = job['id']
+            # Re init agent if using meta ai to avoid limit context window issues
+            agent = self.agent
+            if not self.args.use_openai:
+                agent = AIAgent(self.args.first_name, rate_limiter=self.rate_limiter).agent
+
+            position = job.get('title', '')
+            seek_success = False
+            email_success = False
+            emails_contacted = []
+            upload_waits = {}
+
+            async with self.llm_slots:
+                cover_letter = await agent.aprepare_cover_letter(job, self.args.resume_txt, self.args.australian_language)
+            cover_letter_path = self._cover_letter_path(job_id)
+            await asyncio.to_thread(generate_cover_letter_pdf, cover_letter, cover_letter_path)
+
+            # Skip over jobs that require questions to be answered
+            if seek_client.is_logged_in and (not job['hasRoleRequirements'] and not job['isExternalApply']):
+                async with self.seek_slots:
+                    success = await seek_client.apply(job_id, resume_path=self.args.resume_pdf_path, cover_letter_path=cover_letter_path, show_recent_role=self.args.show_recent_role, timings=upload_waits)
+                if success:
+                    logging.info(f"successfully applied to job {job_id} via seek")
+                    seek_success = True
+
+            for email in job['emails']:
+                # Claim the address before awaiting so concurrent jobs don't contact it twice
+                if self.should_skip_email(email) or email in self.emails_in_progress:
+                    continue
+                self.emails_in_progress.add(email)
+                try:
+                    msg = self.email_templates.render(agent, job)
+                    if msg is None:
+                        async with self.llm_slots:
+                            await asyncio.to_thread(self.email_templates.refresh, agent)
+                        msg = self.email_templates.render(agent, job)
+                    if msg is None:
+                        continue
+
+                    async with self.smtp_slots:
+                        success = await asyncio.to_thread(
+                            self.mail_client.send_application,
+                            email,
+                            job,
+                            msg,
+                            self.args.resume_pdf_path,
+                            cover_letter_path
+                        )
+                    if success:
+                        email_success = True
+                        emails_contacted.append(email)
+                        self.state.record_email_contact(email, job_id)
+                finally:
+                    self.emails_in_progress.discard(email)
+
+            self.state.record_job(job_id, {
+                'applied_on': datetime.now().isoformat(),
+                'similarity_score': score,
+                'applied_via_seek': seek_success,
+                'applied_via_email': email_success,
+                'emails_contacted': emails_contacted,
+                'seek_upload_wait': upload_waits,
+                'position': position,
+                'link': job.get('jobLink', '')
+            })
+            return True
+        except Exception as e:
+            logging.error(f"Error processing job application: {e}")
+            return False
+        finally:
+            # The letter is only needed while this job's applications are sent, a failed job writes a new one next run
+            if cover_letter_path:
+                shutil.rmtree(os.path.dirname(cover_letter_path), ignore_errors=True)
+
+    def _cover_letter_path(self, job_id):
+        # Each job gets its own directory so concurrent jobs never overwrite each other's letter
+        path = Path(self.args.cover_letter_path)
+        job_dir = path.parent / "cover_letters" / str(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        return str(job_dir / path.name)
 
     async def _run_ufl_notifications(self):
         logging.info("Scraping UF job listings...")
         jobs = await self.scraper.scrape()
-        if not jobs:
-            logging.info("No jobs found for UF listing, exiting.")
+        if self.scraper.unchanged or not jobs:
+            if self.scraper.unchanged:
+                logging.info("UF listing unchanged since last run")
+            else:
+                logging.info("No jobs found for UF listing")
+            # Jobs held back by an earlier run still go out once their digest is due
+            if self.digest.get("enabled") and self.scraper.digest_due():
+                await self._send_ufl_digest([], self._notification_email())
+            if not self.scraper.unchanged:
+                self.scraper.commit_http_cache()
             return
 
-        notification_email = self.args.notify_email
-        if not notification_email:
-            notification_email = self.mail_client.user_email
+        if self.digest.get("enabled"):
+            complete = await self._send_ufl_digest(jobs, self._notification_email())
+        else:
+            complete = await self._send_ufl_notifications(jobs, self._notification_email())
+
+        # Jobs still waiting to be sent need the next run to process the listing again
+        if complete:
+            self.scraper.commit_http_cache()
 
+    def _notification_email(self):
+        # Only asks the mail client when no address was given, so runs with nothing to send don't log in
+        return self.args.notify_email or self.mail_client.user_email
+
+    async def _send_ufl_notifications(self, jobs, notification_email):
+        complete = True
         for job in jobs:
             job_id = job.get("id")
             if not job_id:
                 continue
-            if job_id in self.applied["jobs"]:
+            if self.state.is_applied(job_id):
                 logging.info(f"Already notified for job {job_id}, skipping.")
                 continue
 
@@ -179,15 +354,93 @@ class ApplicationPipeline:
             ]
             body = "\n".join(body_lines)
 
-            success = self.mail_client.send_notification(notification_email, subject, body)
+            success = await asyncio.to_thread(self.mail_client.send_notification, notification_email, subject, body)
             if not success:
                 logging.error(f"Failed to send notification for job {job_id}")
+                complete = False
+                continue
+
+            self.state.record_job(job_id, self._ufl_record(job))
+        return complete
+
+    def _ufl_record(self, job):
+        return {
+            "notified_on": datetime.now().isoformat(),
+            "position": job.get("title", ""),
+            "link": job.get("jobLink", ""),
+            "source": "ufl",
+        }
+
+    async def _send_ufl_digest(self, jobs, notification_email):
+        max_batch_size = self.digest.get("max_batch_size", 25)
+        flush_interval = self.digest.get("flush_interval", 0)
+
+        # Jobs found by earlier runs that were held back until the flush interval passed
+        pending = {job["id"]: job for job in self.state.get_meta(DIGEST_PENDING_KEY, [])}
+        for job in jobs:
+            if job.get("id"):
+                pending.setdefault(job["id"], job)
+        pending_jobs = [job for job in pending.values() if not self.state.is_applied(job["id"])]
+        if not pending_jobs:
+            logging.info("No new UF jobs to notify about.")
+            self.scraper.set_digest_due(None)
+            return True
+
+        last_sent = self.state.get_meta(DIGEST_LAST_SENT_KEY)
+        due = (
+            not last_sent
+            or len(pending_jobs) >= max_batch_size
+            or (datetime.now() - datetime.fromisoformat(last_sent)).total_seconds() >= flush_interval
+        )
+        if not due:
+            self.state.set_meta(DIGEST_PENDING_KEY, pending_jobs)
+            self.scraper.set_digest_due(datetime.fromisoformat(last_sent) + timedelta(seconds=flush_interval))
+            logging.info(f"Queued {len(pending_jobs)} UF jobs for the next digest")
+            return False
+
+        unsent = []
+        for start in range(0, len(pending_jobs), max_batch_size):
+            batch = pending_jobs[start:start + max_batch_size]
+            subject, body, html_body = self._build_digest(batch)
+            success = await asyncio.to_thread(self.mail_client.send_notification, notification_email, subject, body, html_body)
+            if not success:
+                logging.error(f"Failed to send digest for {len(batch)} jobs")
+                unsent.extend(batch)
                 continue
+            self.state.record_jobs({job["id"]: self._ufl_record(job) for job in batch})
+            self.state.set_meta(DIGEST_LAST_SENT_KEY, datetime.now().isoformat())
+            logging.info(f"Sent digest for {len(batch)} UF jobs")
+        self.state.set_meta(DIGEST_PENDING_KEY, unsent)
+        # Batches that failed to send are retried by the next run
+        self.scraper.set_digest_due(datetime.now() if unsent else None)
+        return not unsent
+
+    def _build_digest(self, jobs):
+        subject = f"{len(jobs)} new UF job opening{'s' if len(jobs) != 1 else ''}"
+        fields = [
+            ("Title", "title", "Unknown"),
+            ("Job ID", "id", ""),
+            ("Location", "location", "Not listed"),
+            ("Category", "category", "Not listed"),
+            ("Work type", "work_type", "Not listed"),
+        ]
+
+        text_blocks = []
+        rows = []
+        for job in jobs:
+            values = [job.get(key) or default for _, key, default in fields]
+            link = job.get("jobLink", "")
+            text_blocks.append("\n".join(
+                [f"{label}: {value}" for (label, _, _), value in zip(fields, values)] + [f"Link: {link}"]
+            ))
+            cells = "".join(f"<td>{html.escape(str(value))}</td>" for value in values)
+            rows.append(f'<tr>{cells}<td><a href="{html.escape(link)}">View</a></td></tr>')
 
-            self.applied["jobs"][job_id] = {
-                "notified_on": datetime.now().isoformat(),
-                "position": job.get("title", ""),
-                "link": job.get("jobLink", ""),
-                "source": "ufl",
-            }
-            write_json_file(self.args.applied_path, self.applied)
+        body = "\n\n".join(text_blocks)
+        headers = "".join(f"<th align=\"left\">{label}</th>" for label, _, _ in fields)
+        html_body = (
+            f"<p>{html.escape(subject)}</p>"
+            f"<table border=\"1\" cellpadding=\"4\" cellspacing=\"0\">"
+            f"<tr>{headers}<th align=\"left\">Link</th></tr>{''.join(rows)}</table>"
+        )
+        return subject, body, html_body
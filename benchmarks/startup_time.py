@@ -0,0 +1,93 @@
+"""
+Cold start benchmark for each run mode
+Run with: uv run python benchmarks/startup_time.py [--repeat 5]
+
+Every sample starts a fresh interpreter, imports main and builds the
+ApplicationPipeline for the mode's config, then reports how long that took
+and which heavy optional dependencies ended up imported.
+"""
+
+from pathlib import Path
+import statistics
+import subprocess
+import argparse
+import tempfile
+import json
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ["torch", "sentence_transformers", "numpy", "openai", "meta_ai_api", "apify_client", "curl_cffi", "reportlab", "PyPDF2"]
+
+MODES = {
+    "ufl notify": {
+        "source": "ufl",
+        "mode": "notify",
+        "base_url": "https://explore.jobs.ufl.edu/en-us/filter/",
+        "filters": {},
+    },
+    "seek apply": {
+        "source": "seek",
+        "mode": "apply",
+        "searchTerms": ["python developer"],
+    },
+}
+
+SAMPLE = """
+import time
+start = time.perf_counter()
+import main
+from application_pipeline.job_application_pipeline import ApplicationPipeline
+imported = time.perf_counter()
+import json, sys, os
+config, workdir, heavy_modules = json.loads(sys.argv[1]), sys.argv[2], json.loads(sys.argv[3])
+# Defaults straight from config.args, so the sample always has every arg the pipeline reads
+sys.argv = ["main.py", "--first_name", "Benchmark"]
+from config.args import add_args
+args = add_args()
+# Files the pipeline writes go in the sample's temp dir instead of application_materials
+for name, value in vars(args).items():
+    if name.endswith(("_path", "_dir")) and name != "config_path" and value:
+        setattr(args, name, os.path.join(workdir, os.path.basename(value)))
+args.resume_txt = "" if config["source"] == "ufl" else "Python developer with five years of backend experience."
+args.use_openai = False
+ApplicationPipeline(config, args)
+ready = time.perf_counter()
+heavy = [name for name in heavy_modules if name in sys.modules]
+print(json.dumps({"import": imported - start, "init": ready - imported, "heavy": heavy}))
+"""
+
+
+def run_sample(config, workdir):
+    result = subprocess.run(
+        [sys.executable, "-c", SAMPLE, json.dumps(config), workdir, json.dumps(HEAVY_MODULES)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12} {'import (s)':>11} {'init (s)':>10} {'total (s)':>10}  heavy modules loaded")
+    for mode, config in MODES.items():
+        samples = []
+        try:
+            for _ in range(args.repeat):
+                # A fresh state and embedding cache each sample so nothing warm carries over
+                with tempfile.TemporaryDirectory() as workdir:
+                    samples.append(run_sample(config, workdir))
+        except RuntimeError as e:
+            print(f"{mode:<12} failed: {e}")
+            continue
+        import_time = statistics.median(s["import"] for s in samples)
+        init_time = statistics.median(s["init"] for s in samples)
+        print(f"{mode:<12} {import_time:>11.3f} {init_time:>10.3f} {import_time + init_time:>10.3f}  {', '.join(samples[-1]['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark for the UF listing parser
+Run from the repo root with: uv run python -m benchmarks.ufl_parser [--repeat 20]
+
+Builds listing pages of several sizes from benchmarks/fixtures/ufl_listing.html
+and compares the previous two-pass regex extractor, which only took ids and
+titles, with the streaming parser fed in the same chunk size the scraper reads
+responses with, which also fills in location, category and work type.
+"""
+
+from scrapers.ufl_parser import parse_ufl_page
+from scrapers.scraper import JobScraper
+from pathlib import Path
+import argparse
+import timeit
+import re
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "ufl_listing.html"
+SIZES = [20, 200, 2000]
+
+
+def build_page(template, jobs):
+    # The fixture marks one listing row and one JSON entry, repeat each once per job
+    page = template
+    for marker in ("rows", "json"):
+        start, end = f"<!-- {marker} -->\n", f"<!-- /{marker} -->\n"
+        head, rest = page.split(start, 1)
+        block, tail = rest.split(end, 1)
+        page = head + "".join(block.replace("{id}", str(100000 + i)) for i in range(jobs)) + tail
+    return page
+
+
+def regex_parse(html_text):
+    # The extractor the scraper used before the streaming parser, kept for comparison
+    jobs = []
+    seen_links = set()
+    for match in re.finditer(r'<a[^>]+href="(?P<link>[^"]+)"[^>]*>(?P<title>[^<]+)</a>', html_text):
+        link = match.group("link")
+        if "/en-us/job/" not in link:
+            continue
+        job_link = f"https://explore.jobs.ufl.edu{link}"
+        if job_link in seen_links:
+            continue
+        seen_links.add(job_link)
+        jobs.append({"id": link.rstrip("/").split("/")[-1], "title": match.group("title").strip(), "jobLink": job_link})
+    for match in re.finditer(r'"jobLink":"(?P<link>/en-us/job/[^"]+)"', html_text):
+        link = match.group("link")
+        job_link = f"https://explore.jobs.ufl.edu{link}"
+        if job_link in seen_links:
+            continue
+        seen_links.add(job_link)
+        jobs.append({"id": link.rstrip("/").split("/")[-1], "title": "", "jobLink": job_link})
+    return jobs
+
+
+def streaming_parse(html_text):
+    chunk_size = JobScraper.UFL_CHUNK_SIZE
+    return parse_ufl_page(html_text[i:i + chunk_size] for i in range(0, len(html_text), chunk_size))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    template = FIXTURE.read_text(encoding="utf-8")
+    print(f"{'jobs':>6} {'page (KB)':>10} {'regex (ms)':>11} {'streaming (ms)':>15} {'fields filled':>14}")
+    for size in SIZES:
+        page = build_page(template, size)
+        regex_time = min(timeit.repeat(lambda: regex_parse(page), number=1, repeat=args.repeat))
+        stream_time = min(timeit.repeat(lambda: streaming_parse(page), number=1, repeat=args.repeat))
+        jobs = streaming_parse(page).jobs.values()
+        filled = sum(all(job[key] for key in ("location", "category", "work_type")) for job in jobs)
+        print(f"{size:>6} {len(page) / 1024:>10.0f} {regex_time * 1000:>11.2f} {stream_time * 1000:>15.2f} {filled:>8}/{len(jobs)}")
+
+
+if __name__ == "__main__":
+    main()
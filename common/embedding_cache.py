@@ -0,0 +1,118 @@
+from pathlib import Path
+import numpy as np
+import hashlib
+import logging
+import json
+import time
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+
+
+class EmbeddingCache:
+    INDEX_FILE = "index.json"
+    VECTORS_FILE = "vectors.f32"
+    KEYS_FILE = "keys.bin"
+
+    def __init__(self, cache_dir, model_name, max_entries=5000):
+        self.cache_dir = Path(cache_dir)
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.index_path = self.cache_dir / self.INDEX_FILE
+        self.vectors_path = self.cache_dir / self.VECTORS_FILE
+        self.keys_path = self.cache_dir / self.KEYS_FILE
+        self.dim = None
+        self.vectors = None
+        self.slot_keys = None
+        # key -> [slot in the vectors file, last used timestamp]
+        self.entries = {}
+        self._load()
+
+    def _load(self):
+        if not all(path.exists() for path in (self.index_path, self.vectors_path, self.keys_path)):
+            return
+        try:
+            index = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Ignoring unreadable embedding cache index {self.index_path}: {e}")
+            return
+
+        if index.get("model") != self.model_name or index.get("capacity") != self.max_entries:
+            logging.info("Embedding cache was built for a different model or size, starting a new one")
+            return
+
+        try:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.max_entries, index["dim"]))
+            self.slot_keys = np.memmap(self.keys_path, dtype="S32", mode="r+", shape=(self.max_entries,))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable embedding cache {self.cache_dir}: {e}")
+            self.vectors = None
+            self.slot_keys = None
+            return
+        self.dim = index["dim"]
+        self.entries = index["entries"]
+
+    def _create(self, dim):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.dim = dim
+        self.entries = {}
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="w+", shape=(self.max_entries, dim))
+        self.slot_keys = np.memmap(self.keys_path, dtype="S32", mode="w+", shape=(self.max_entries,))
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def _free_slot(self):
+        # Slots fill up in order, once full the least recently used entry gives up its slot
+        if len(self.entries) < self.max_entries:
+            return len(self.entries)
+        lru_key = min(self.entries, key=lambda key: self.entries[key][1])
+        return self.entries.pop(lru_key)[0]
+
+    def get_many(self, texts):
+        now = time.time()
+        vectors = []
+        for text in texts:
+            key = self._key(text)
+            entry = self.entries.get(key)
+            # The slot may have been reused after the index was last flushed
+            if entry is None or self.slot_keys[entry[0]] != key.encode("ascii"):
+                vectors.append(None)
+                continue
+            entry[1] = now
+            vectors.append(np.array(self.vectors[entry[0]]))
+        return vectors
+
+    def put_many(self, texts, vectors):
+        if self.vectors is None:
+            self._create(vectors.shape[1])
+        now = time.time()
+        for text, vector in zip(texts, vectors):
+            key = self._key(text)
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [self._free_slot(), now]
+            entry[1] = now
+            self.vectors[entry[0]] = vector
+            self.slot_keys[entry[0]] = key.encode("ascii")
+
+    def flush(self):
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+        self.slot_keys.flush()
+        index = {
+            "model": self.model_name,
+            "dim": self.dim,
+            "capacity": self.max_entries,
+            "entries": self.entries,
+        }
+        tmp_path = self.index_path.with_suffix(".tmp")
+        try:
+            tmp_path.write_text(json.dumps(index, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logging.error(f"Error writing embedding cache index {self.index_path}: {e}")
@@ -0,0 +1,73 @@
+import threading
+import hashlib
+import logging
+import sqlite3
+import json
+import time
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+
+
+class LLMCache:
+    # Completions keyed by a hash of the model, messages and request options, so a crashed run or a job
+    # showing up under another search term doesn't pay for the same prompt twice
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_on REAL NOT NULL,
+            used_on REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_used_on ON responses (used_on);
+    """
+
+    def __init__(self, path, ttl_days=30, max_entries=2000):
+        self.path = path
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Blocking agent calls run in worker threads, every query goes through the lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def key(self, model, messages, options=None):
+        request = json.dumps({'model': model, 'messages': messages, 'options': options or {}}, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self.conn:
+            row = self.conn.execute("SELECT response, created_on FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.conn.execute("UPDATE responses SET used_on = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_on, used_on) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            # Expired entries go first, then the least recently used ones past the size limit
+            self.conn.execute("DELETE FROM responses WHERE created_on < ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used_on DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def close(self):
+        self.conn.close()
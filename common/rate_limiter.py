@@ -0,0 +1,132 @@
+from contextlib import contextmanager, asynccontextmanager
+import threading
+import logging
+import asyncio
+import time
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+
+# rate requests every per seconds, with up to burst requests allowed back to back
+DEFAULT_RATE_LIMITS = {
+    "metaai": {"rate": 2, "per": 60, "burst": 1},
+    "openai": {"rate": 60, "per": 60, "burst": 10},
+    "seek": {"rate": 30, "per": 60, "burst": 5},
+    "smtp": {"rate": 20, "per": 60, "burst": 5},
+}
+
+# SMTP reply servers use to signal too many connections/messages, 45x codes are mailbox or resource errors
+THROTTLE_SMTP_CODE = 421
+
+
+def _status_code(exc):
+    status = getattr(exc, 'status_code', None)
+    response = getattr(exc, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+def is_rate_limited(exc):
+    # Only explicit status codes count, error messages can mention numbers like 429 for any reason
+    return _status_code(exc) == 429 or getattr(exc, 'smtp_code', None) == THROTTLE_SMTP_CODE
+
+
+def retry_after(exc):
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, name, rate, per=1, burst=1):
+        self.name = name
+        self.base_rate = rate / per
+        self.rate = self.base_rate
+        self.min_rate = self.base_rate / 16
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # Buckets are shared by event loop tasks and client calls running in worker threads
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Tokens can go negative so waiting callers queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            logging.info(f"Rate limit reached for {self.name}, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+    def wait(self):
+        # Blocking variant for sync clients, only call it off the event loop thread
+        wait = self._reserve()
+        if wait > 0:
+            logging.info(f"Rate limit reached for {self.name}, waiting {wait:.1f}s")
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.blocked_until = max(self.blocked_until, now + (retry_after or 1 / self.rate))
+        logging.warning(f"{self.name} is rate limiting requests, backing off to {self.rate * 60:.1f} requests/min")
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.base_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.base_rate, self.rate + self.base_rate / 10)
+
+    @contextmanager
+    def limit(self):
+        self.wait()
+        try:
+            yield
+        except Exception as e:
+            if is_rate_limited(e):
+                self.throttled(retry_after(e))
+            raise
+        self.succeeded()
+
+    @asynccontextmanager
+    async def alimit(self):
+        await self.acquire()
+        try:
+            yield
+        except Exception as e:
+            if is_rate_limited(e):
+                self.throttled(retry_after(e))
+            raise
+        self.succeeded()
+
+
+class RateLimiter:
+    def __init__(self, limits=None):
+        limits = limits or {}
+        self.buckets = {}
+        for name in DEFAULT_RATE_LIMITS.keys() | limits.keys():
+            config = {**DEFAULT_RATE_LIMITS.get(name, {}), **limits.get(name, {})}
+            self.buckets[name] = TokenBucket(name, **config)
+
+    def __getitem__(self, name):
+        return self.buckets[name]
@@ -0,0 +1,227 @@
+from common.utils import load_json_file, write_json_file
+from datetime import datetime
+from pathlib import Path
+import logging
+import sqlite3
+import json
+import sys
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+
+
+class JsonStateStore:
+    # Legacy backend, every update rewrites the whole file
+    def __init__(self, path):
+        self.path = path
+        self.data = load_json_file(path) or {}
+        self.data.setdefault('jobs', {})
+        self.data.setdefault('email_history', {})
+        self.data.setdefault('rejected', {})
+
+    def is_applied(self, job_id):
+        return job_id in self.data['jobs']
+
+    def record_job(self, job_id, record):
+        self.data['jobs'][job_id] = record
+        write_json_file(self.path, self.data)
+
+    def record_jobs(self, records):
+        self.data['jobs'].update(records)
+        write_json_file(self.path, self.data)
+
+    def record_email_contact(self, email, job_id, contacted_on=None):
+        contacted_on = contacted_on or datetime.now().isoformat()
+        history = self.data['email_history'].setdefault(email, {'jobs_contacted': []})
+        history['last_contacted'] = contacted_on
+        history['jobs_contacted'].append(job_id)
+        write_json_file(self.path, self.data)
+
+    def last_contacted(self, email):
+        history = self.data['email_history'].get(email)
+        if not history:
+            return None
+        return datetime.fromisoformat(history['last_contacted'])
+
+    def get_rejection(self, job_id):
+        return self.data['rejected'].get(job_id)
+
+    def record_rejections(self, records):
+        self.data['rejected'].update(records)
+        write_json_file(self.path, self.data)
+
+    def get_meta(self, key, default=None):
+        return self.data.get('meta', {}).get(key, default)
+
+    def set_meta(self, key, value):
+        self.data.setdefault('meta', {})[key] = value
+        write_json_file(self.path, self.data)
+
+    def to_dict(self):
+        return self.data
+
+    def close(self):
+        # Every update is already written out
+        pass
+
+
+class SQLiteStateStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            recorded_on TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS email_contacts (
+            email TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            contacted_on TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_email_contacts_email ON email_contacts (email, contacted_on);
+        CREATE TABLE IF NOT EXISTS rejected_jobs (
+            job_id TEXT PRIMARY KEY,
+            score REAL NOT NULL,
+            content_hash TEXT NOT NULL,
+            rejected_on TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        if read_only:
+            # Readers like the dashboard neither create the file nor touch its schema or journal mode
+            self.conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+            return
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        # WAL keeps each commit to an append, NORMAL sync is still crash safe in WAL mode
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def is_applied(self, job_id):
+        row = self.conn.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None
+
+    def record_job(self, job_id, record):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, recorded_on, data) VALUES (?, ?, ?)",
+                (job_id, datetime.now().isoformat(), json.dumps(record)),
+            )
+
+    def record_jobs(self, records):
+        recorded_on = datetime.now().isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO jobs (job_id, recorded_on, data) VALUES (?, ?, ?)",
+                [(job_id, recorded_on, json.dumps(record)) for job_id, record in records.items()],
+            )
+
+    def record_email_contact(self, email, job_id, contacted_on=None):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO email_contacts (email, job_id, contacted_on) VALUES (?, ?, ?)",
+                (email, job_id, contacted_on or datetime.now().isoformat()),
+            )
+
+    def last_contacted(self, email):
+        row = self.conn.execute("SELECT MAX(contacted_on) FROM email_contacts WHERE email = ?", (email,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return datetime.fromisoformat(row[0])
+
+    def get_rejection(self, job_id):
+        row = self.conn.execute("SELECT score, content_hash FROM rejected_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return {'score': row[0], 'content_hash': row[1]} if row else None
+
+    def record_rejections(self, records):
+        rejected_on = datetime.now().isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rejected_jobs (job_id, score, content_hash, rejected_on) VALUES (?, ?, ?, ?)",
+                [(job_id, record['score'], record['content_hash'], rejected_on) for job_id, record in records.items()],
+            )
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def to_dict(self):
+        jobs = {job_id: json.loads(data) for job_id, data in self.conn.execute("SELECT job_id, data FROM jobs")}
+        email_history = {}
+        rows = self.conn.execute("SELECT email, job_id, contacted_on FROM email_contacts ORDER BY contacted_on")
+        for email, job_id, contacted_on in rows:
+            history = email_history.setdefault(email, {'jobs_contacted': []})
+            history['last_contacted'] = contacted_on
+            history['jobs_contacted'].append(job_id)
+        return {'jobs': jobs, 'email_history': email_history}
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_json_to_sqlite(json_path, store):
+    if store.get_meta('migrated_from'):
+        logging.info(f"{store.path} was already migrated from {store.get_meta('migrated_from')}, skipping.")
+        return
+    applied = load_json_file(json_path)
+    jobs = applied.get('jobs', {})
+    email_history = applied.get('email_history', {})
+    with store.conn:
+        store.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (job_id, recorded_on, data) VALUES (?, ?, ?)",
+            [
+                (job_id, record.get('applied_on') or record.get('notified_on') or datetime.now().isoformat(), json.dumps(record))
+                for job_id, record in jobs.items()
+            ],
+        )
+        # The JSON file only kept the latest contact date, so every job for an address gets that date
+        store.conn.executemany(
+            "INSERT INTO email_contacts (email, job_id, contacted_on) VALUES (?, ?, ?)",
+            [
+                (email, job_id, history['last_contacted'])
+                for email, history in email_history.items()
+                for job_id in history.get('jobs_contacted', [])
+            ],
+        )
+        store.conn.executemany(
+            "INSERT OR IGNORE INTO rejected_jobs (job_id, score, content_hash, rejected_on) VALUES (?, ?, ?, ?)",
+            [
+                (job_id, record['score'], record['content_hash'], datetime.now().isoformat())
+                for job_id, record in applied.get('rejected', {}).items()
+            ],
+        )
+        store.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", ('migrated_from', json.dumps(str(json_path))))
+    logging.info(f"Migrated {len(jobs)} jobs and {len(email_history)} email contacts from {json_path}")
+
+
+def open_state_store(backend, path, json_path=None):
+    if backend == "json":
+        return JsonStateStore(json_path or path)
+
+    store = SQLiteStateStore(path)
+    # Checked against the meta key rather than the file, so a first run interrupted mid migration retries it
+    if json_path and Path(json_path).exists() and not store.get_meta('migrated_from'):
+        migrate_json_to_sqlite(json_path, store)
+    return store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python -m common.state_store <applied.json> <applied.db>")
+    store = SQLiteStateStore(sys.argv[2])
+    migrate_json_to_sqlite(sys.argv[1], store)
+    store.close()
@@ -1,8 +1,3 @@
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.units import inch
-from PyPDF2 import PdfReader
 from pathlib import Path
 import logging
 import json
@@ -15,6 +10,11 @@ logging.basicConfig(
 )
 
 def generate_cover_letter_pdf(cover_letter, output_file):
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch
+
     document = SimpleDocTemplate(output_file, pagesize=A4)
 
     styles = getSampleStyleSheet()
@@ -52,6 +52,8 @@ def format_cover_letter(cover_letter):
     return formatted_lines
 
 def extract_text_from_pdf(pdf_path):
+    from PyPDF2 import PdfReader
+
     try:
         reader = PdfReader(pdf_path)
         text = ""
@@ -25,9 +25,25 @@ def add_args():
     
     parser.add_argument('--applied_path', 
                         type=str,
-                        help='Path to applied jobs',
+                        help='Path to applied jobs json, used by the json backend and migrated into sqlite on first run',
                         default="application_pipeline/application_materials/applied.json")
 
+    parser.add_argument('--state_backend',
+                        type=str,
+                        choices=['sqlite', 'json'],
+                        help='Storage backend for applied jobs and contacted emails',
+                        default="sqlite")
+
+    parser.add_argument('--state_path',
+                        type=str,
+                        help='Path to the sqlite state database',
+                        default="application_pipeline/application_materials/applied.db")
+
+    parser.add_argument('--http_cache_path',
+                        type=str,
+                        help='Path to cached ETag/Last-Modified headers and page hashes for scheduled UF scrapes',
+                        default="application_pipeline/application_materials/http_cache.json")
+
     parser.add_argument('--mail_protocol', 
                         type=str,
                         help='Mail protocol e.g gmail.com, outlook.com',
@@ -49,18 +65,95 @@ def add_args():
                         help='openai gpt model',
                         default="gpt-4o-mini")
 
+    parser.add_argument('--single_pass',
+                        type=int,
+                        help='Write and self check openai cover letters in one structured call, only reviewing ones that fail local checks. 0 = False',
+                        default=0)
+
     parser.add_argument('--min_score', 
                         type=float,
                         help='Min job matching score',
                         default=0.4)
     
+    parser.add_argument('--embed_batch_size',
+                        type=int,
+                        help='Number of job descriptions embedded per model batch',
+                        default=64)
+
+    parser.add_argument('--embedding_cache_dir',
+                        type=str,
+                        help='Directory for cached job description embeddings',
+                        default="application_pipeline/application_materials/embedding_cache")
+
+    parser.add_argument('--embedding_cache_size',
+                        type=int,
+                        help='Max number of cached embeddings before least recently used ones are evicted',
+                        default=5000)
+
     parser.add_argument('--show_recent_role',
                             type=int,
                             help='Adds recent role to seek job application for employers. 0 = False',
                             default=1)
     
+    parser.add_argument('--email_templates_path',
+                        type=str,
+                        help='Path to the cached recruiter email templates, rewritten once a day',
+                        default="application_pipeline/application_materials/email_templates.json")
+
+    parser.add_argument('--email_variants',
+                        type=int,
+                        help='Number of recruiter email variants written per day',
+                        default=3)
+
+    parser.add_argument('--llm_usage_path',
+                        type=str,
+                        help='JSONL file recording token usage, cached prompt tokens and latency of every openai call',
+                        default="application_pipeline/application_materials/llm_usage.jsonl")
+
+    parser.add_argument('--llm_cache',
+                        type=int,
+                        help='Reuse cached openai cover letters and reviews for identical prompts. 0 = bypass the cache',
+                        default=1)
+
+    parser.add_argument('--llm_cache_path',
+                        type=str,
+                        help='Path to the sqlite cache of openai responses',
+                        default="application_pipeline/application_materials/llm_cache.db")
+
+    parser.add_argument('--llm_cache_ttl_days',
+                        type=int,
+                        help='Days a cached openai response is reused for',
+                        default=30)
+
+    parser.add_argument('--llm_cache_size',
+                        type=int,
+                        help='Max number of cached openai responses before least recently used ones are evicted',
+                        default=2000)
+
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of jobs processed concurrently',
+                        default=4)
+
+    parser.add_argument('--llm_concurrency',
+                        type=int,
+                        help='Max concurrent LLM requests',
+                        default=2)
+
+    parser.add_argument('--seek_concurrency',
+                        type=int,
+                        help='Max concurrent seek applications',
+                        default=1)
+
+    parser.add_argument('--smtp_concurrency',
+                        type=int,
+                        help='Max concurrent outgoing emails',
+                        default=2)
+
     args = parser.parse_args()
     args.australian_language = bool(args.australian_language)
     args.show_recent_role = bool(args.show_recent_role)
+    args.single_pass = bool(args.single_pass)
+    args.llm_cache = bool(args.llm_cache)
 
     return args
@@ -1,7 +1,10 @@
-from meta_ai_api import MetaAI
+from common.rate_limiter import RateLimiter
 from dotenv import load_dotenv
-from openai import OpenAI
+import threading
 import logging
+import asyncio
+import json
+import time
 import os
 import re
 
@@ -12,21 +15,230 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
 )
 
+# Single pass cover letters, the letter and the model's own check come back as one json object
+COVER_LETTER_MAX_WORDS = 400
+SELF_CHECK_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "checked_cover_letter",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "cover_letter": {"type": "string"},
+                "self_check": {
+                    "type": "object",
+                    "properties": {
+                        "has_placeholders": {"type": "boolean"},
+                        "unsupported_claims": {"type": "array", "items": {"type": "string"}},
+                    },
+                    "required": ["has_placeholders", "unsupported_claims"],
+                    "additionalProperties": False,
+                },
+            },
+            "required": ["cover_letter", "self_check"],
+            "additionalProperties": False,
+        },
+    },
+}
+# Sent after the job details so the cached instructions and resume prefix is the same as the two call flow
+SELF_CHECK_MESSAGE = {
+    "role": "user",
+    "content": f"""
+            Respond with a json object instead of plain text. Put the complete cover letter in `cover_letter`.
+            Then verify that letter yourself and fill in `self_check`:
+            * `has_placeholders`: true if the letter contains any square brackets or placeholder text.
+            * `unsupported_claims`: every skill, technology, experience or accomplishment claimed in the letter
+              that is not explicitly mentioned in the [RESUME_TEXT], empty if there are none.
+            The letter must be no more than {COVER_LETTER_MAX_WORDS} words.
+            """
+}
+SKILL_TOKEN_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9+#.]*[A-Za-z0-9+#]")
+# A letter for the same job and resume is worth reusing, email calls are repeated on purpose to get different variants
+CACHED_PURPOSES = {"cover_letter", "review"}
+
+
 class AIAgent:
-    def __init__(self, name, model=""):
+    def __init__(self, name, model="", rate_limiter=None, usage_log=None, single_pass=False, llm_cache=None):
+        rate_limiter = rate_limiter or RateLimiter()
         if os.getenv("OPENAI_KEY"):
-            self.agent = OpenAiAgent(name, model)
+            self.agent = OpenAiAgent(name, model, rate_limiter["openai"], usage_log, single_pass, llm_cache)
         else:
-            self.agent = MetaAI(name)
+            self.agent = MetaAgent(name, rate_limiter["metaai"])
+
+
+class UsageLog:
+    # One JSON line per completion with token usage, prompt tokens served from the provider's cache and latency
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, model, purpose, response, elapsed):
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', None) or 0
+        logging.info(f"{purpose}: {usage.prompt_tokens} prompt tokens ({cached_tokens} cached), {usage.completion_tokens} completion tokens in {elapsed:.1f}s")
+        if not self.path:
+            return
+        entry = {
+            'time': time.time(),
+            'model': model,
+            'purpose': purpose,
+            'prompt_tokens': usage.prompt_tokens,
+            'cached_tokens': cached_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'latency': round(elapsed, 3),
+        }
+        try:
+            with self._lock:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logging.error(f"Error writing llm usage to {self.path}: {e}")
 
 
 class OpenAiAgent:
-    def __init__(self, name, model):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
+    def __init__(self, name, model, rate_limit=None, usage_log=None, single_pass=False, llm_cache=None):
+        self._client = None
+        self._async_client = None
         self.model = model
         self.name = name
-    
-    def prepare_cover_letter(self, job_data, resume, convert_to_australian_language):
+        self.single_pass = single_pass
+        self.rate_limit = rate_limit or RateLimiter()["openai"]
+        self.usage_log = usage_log or UsageLog()
+        self.llm_cache = llm_cache
+
+    @property
+    def client(self):
+        # The openai package and client are only created on the first completion
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
+        return self._async_client
+
+    def _complete(self, messages, purpose="completion", **kwargs):
+        key = self._cache_key(messages, purpose, kwargs)
+        cached = self._cached_response(key, purpose)
+        if cached is not None:
+            return cached
+        with self.rate_limit.limit():
+            started = time.monotonic()
+            response = self.client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        self.usage_log.record(self.model, purpose, response, time.monotonic() - started)
+        self._cache_response(key, response)
+        return response
+
+    async def _acomplete(self, messages, purpose="completion", **kwargs):
+        key = self._cache_key(messages, purpose, kwargs)
+        cached = self._cached_response(key, purpose)
+        if cached is not None:
+            return cached
+        async with self.rate_limit.alimit():
+            started = time.monotonic()
+            response = await self.async_client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        self.usage_log.record(self.model, purpose, response, time.monotonic() - started)
+        self._cache_response(key, response)
+        return response
+
+    def _cache_key(self, messages, purpose, options):
+        if self.llm_cache is None or purpose not in CACHED_PURPOSES:
+            return None
+        return self.llm_cache.key(self.model, messages, options)
+
+    def _cached_response(self, key, purpose):
+        if key is None:
+            return None
+        cached = self.llm_cache.get(key)
+        if cached is None:
+            return None
+        from openai.types.chat import ChatCompletion
+        logging.info(f"{purpose}: served from the llm cache")
+        return ChatCompletion.model_validate_json(cached)
+
+    def _cache_response(self, key, response):
+        # Truncated or filtered completions are left out so the next run asks again
+        if key is None or response.choices[0].finish_reason != "stop":
+            return
+        self.llm_cache.put(key, self.model, response.model_dump_json())
+
+    async def aprepare_cover_letter(self, job_data, resume, convert_to_australian_language):
+        # Awaits instead of blocking so letters for many jobs overlap
+        messages, job_description = self._cover_letter_messages(job_data, resume, convert_to_australian_language)
+        if self.single_pass:
+            response = await self._acomplete(messages + [SELF_CHECK_MESSAGE], "cover_letter", response_format=SELF_CHECK_FORMAT)
+            cover_text, issues = self._check_cover_letter(response, resume, job_data)
+            if not issues:
+                return self._finish_cover_letter(cover_text)
+        else:
+            cover_text = (await self._acomplete(messages, "cover_letter")).choices[0].message.content.strip()
+            issues = []
+        final_coverletter = await self.areview_coverletter(cover_text, resume, job_description, "\n".join(issues))
+        return self._finish_cover_letter(cover_text, final_coverletter)
+
+    def _finish_cover_letter(self, cover_text, final_coverletter=None):
+        if final_coverletter is None:
+            # Passed the local checks, cleaned up the same way a reviewed letter is
+            logging.debug(f"Cover letter passed local checks, review skipped:\n{cover_text}")
+            return cover_text.replace('-', '').strip('```')
+        logging.debug(f"Cover letter draft:\n{cover_text}\nReviewed:\n{final_coverletter}\nUnchanged by review: {cover_text == final_coverletter}")
+        return final_coverletter.strip('```')
+
+    def _check_cover_letter(self, response, resume, job_data):
+        # Returns the letter and the adjustments the review call should make, none means it can be skipped
+        content = response.choices[0].message.content.strip()
+        try:
+            checked = json.loads(content)
+            cover_text = checked['cover_letter'].strip()
+            self_check = checked['self_check']
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+            logging.warning("Single pass cover letter wasn't valid json, sending it to review")
+            return content, ["Remove anything that isn't part of the cover letter itself."]
+
+        issues = []
+        if self_check.get('has_placeholders') or '[' in cover_text or ']' in cover_text:
+            issues.append("Remove every placeholder in square brackets.")
+        word_count = len(cover_text.split())
+        if word_count > COVER_LETTER_MAX_WORDS:
+            issues.append(f"Shorten the letter to no more than {COVER_LETTER_MAX_WORDS} words, it is currently {word_count} words.")
+        unsupported = list(dict.fromkeys(self_check.get('unsupported_claims', []) + self._unsupported_skills(cover_text, resume, job_data)))
+        if unsupported:
+            issues.append(f"Remove these claims, they are not supported by the resume: {', '.join(unsupported)}.")
+        if issues:
+            logging.info(f"Cover letter for {job_data.get('title', 'Unknown position')} needs review: {' '.join(issues)}")
+        return cover_text, issues
+
+    def _unsupported_skills(self, cover_text, resume, job_data):
+        # Names and technologies (capitalised mid sentence, or carrying digits, + or #) that the letter
+        # took from the job ad but that never appear in the resume
+        job_description = job_data.get('content', {}).get('sections', '')
+        company_name = job_data.get('companyProfile', {}).get('name', '')
+        position = job_data.get('title', '')
+        known = {token.lower() for token in SKILL_TOKEN_PATTERN.findall(f"{resume} {company_name} {position}")}
+        job_tokens = {token.lower() for token in SKILL_TOKEN_PATTERN.findall(str(job_description))}
+        skills = []
+        for match in SKILL_TOKEN_PATTERN.finditer(cover_text):
+            token = match.group(0)
+            lower = token.lower()
+            if lower in known or lower not in job_tokens or lower in skills:
+                continue
+            preceding = cover_text[:match.start()].rstrip(" \t")
+            sentence_start = not preceding or preceding[-1] in ".!?:\n-•*"
+            if any(char.isdigit() or char in "+#" for char in token) or token[1:] != token[1:].lower() or (token[0].isupper() and not sentence_start):
+                skills.append(lower)
+        return skills
+
+    def _cover_letter_messages(self, job_data, resume, convert_to_australian_language):
         job_content = job_data.get('content', {})
         job_description = job_content.get('sections', '')
         
@@ -42,37 +254,29 @@ class OpenAiAgent:
             if convert_to_australian_language else ""
         )
 
-        prompt = f"""
+        # Everything up to and including the resume is identical for every job in a run, so the
+        # provider can serve it from its prompt cache. Only the last message changes per job.
+        instructions = f"""
             ## Optimized Prompt for Generating a Cover Letter
 
             ### Goal
             You are an expert career consultant and professional writer. Your task is to generate a 
             **highly targeted, compelling, and professional cover letter** based on the provided 
-            **Resume** and **Job Description** below.
+            **[RESUME_TEXT]** below and the **[JOB_DESCRIPTION_TEXT]**, **Company to Address** and
+            **Position Applied For** given in the next message.
 
-            ### Required Inputs (Context)
-            1.  **[RESUME_TEXT]:**
-                ---
-                {resume}
-                ---
-            2.  **[JOB_DESCRIPTION_TEXT]:**
-                ---
-                {job_description}
-                ---* 
-            3. **Company to Address:** {company_name}
-            4. **Position Applied For:** {position}
-            5.  **Format and Content Constraint (CRITICAL):**
-                * Your output **MUST NOT** contain *any* generic placeholders enclosed in square brackets 
-                (e.g., `[Company Name]`, `[Position Title]`).
-                * **DO NOT** generate any content *before* the salutation or *after* the closing.
-    
-                * **Specifically, you MUST NOT include:**
-                    - The current date
-                    - A sender's address, postcode, or contact information (this is on the resume)
-                    - A recipient's address or postcode
-    
-                * The output must start *directly* with the salutation (e.g., "Dear Hiring Manager,").
-                * The output must end *directly* with the closing (e.g., "Sincerely,"). **Do not add a name after the closing.**
+            ### Format and Content Constraint (CRITICAL)
+            * Your output **MUST NOT** contain *any* generic placeholders enclosed in square brackets 
+            (e.g., `[Company Name]`, `[Position Title]`).
+            * **DO NOT** generate any content *before* the salutation or *after* the closing.
+
+            * **Specifically, you MUST NOT include:**
+                - The current date
+                - A sender's address, postcode, or contact information (this is on the resume)
+                - A recipient's address or postcode
+
+            * The output must start *directly* with the salutation (e.g., "Dear Hiring Manager,").
+            * The output must end *directly* with the closing (e.g., "Sincerely,"). **Do not add a name after the closing.**
             ---
 
             ### Constraints and Negative Prompting
@@ -109,60 +313,54 @@ class OpenAiAgent:
             ```
             [The complete, generated cover letter text, with no extra sections or commentary]
             ```
-            """
-
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a highly skilled, professional career writer. "
-                        "Your sole task is to generate the complete cover letter text. "
-                        "Respond *only* with the final, polished cover letter text. "
-                        "Do not include any introductory remarks, commentary, explanations, "
-                        "or any text other than the cover letter itself. "
-                        "Adhere strictly to the requested structure and formatting rules."
-                    )
-                },
-                {"role": "user", "content": prompt}
-            ]
-        )
 
-        cover_text = response.choices[0].message.content.strip()
-        print(cover_text)
-        print("-"*50)
-        final_coverletter = self.review_coverletter(cover_text, resume, job_description)
-        print(final_coverletter)
-        print(cover_text == final_coverletter)
-        return final_coverletter.strip('```')
+            ### **[RESUME_TEXT]:**
+                ---
+                {resume}
+                ---
+            """
 
-    def review_coverletter(self, cover_letter_text, original_resume, original_job_description, adjustment_requests=""):
         prompt = f"""
+            1.  **[JOB_DESCRIPTION_TEXT]:**
+                ---
+                {job_description}
+                ---* 
+            2. **Company to Address:** {company_name}
+            3. **Position Applied For:** {position}
+            """
+
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "You are a highly skilled, professional career writer. "
+                    "Your sole task is to generate the complete cover letter text. "
+                    "Respond *only* with the final, polished cover letter text. "
+                    "Do not include any introductory remarks, commentary, explanations, "
+                    "or any text other than the cover letter itself. "
+                    "Adhere strictly to the requested structure and formatting rules."
+                )
+            },
+            {"role": "user", "content": instructions},
+            {"role": "user", "content": prompt}
+        ]
+        return messages, job_description
+
+    async def areview_coverletter(self, cover_letter_text, original_resume, original_job_description, adjustment_requests=""):
+        response = await self._acomplete(self._review_messages(cover_letter_text, original_resume, original_job_description, adjustment_requests), "review")
+        return response.choices[0].message.content.strip().replace('-', '')
+
+    def _review_messages(self, cover_letter_text, original_resume, original_job_description, adjustment_requests=""):
+        # Stable instructions and resume first, the job and letter being reviewed last, see _cover_letter_messages
+        instructions = f"""
             ## Optimized Prompt for Cover Letter Verification and Small Adjustments
 
             ### Goal
             You are an expert editor and compliance officer. Your task is to **verify** the provided cover 
             letter text against the original constraints and then apply any requested **small, stylistic 
-            adjustments** without changing the core factual evidence.
-
-            ### Required Inputs (Context)
-            1.  **[COVER_LETTER_TEXT]:** (The letter to be edited)
-                ---
-                {cover_letter_text}
-                ---
-            2.  **[ORIGINAL_RESUME_TEXT]:** (Used for re-verification)
-                ---
-                {original_resume}
-                ---
-            3.  **[ORIGINAL_JOB_DESCRIPTION_TEXT]:** (Used for context)
-                ---
-                {original_job_description}
-                ---
-            4.  **[ADJUSTMENT_REQUESTS]:**
-                ---
-                {adjustment_requests or "No specific adjustments provided. Focus only on verification and minor flow improvements."}
-                ---
+            adjustments** without changing the core factual evidence. The **[ORIGINAL_RESUME_TEXT]** is below,
+            the **[ORIGINAL_JOB_DESCRIPTION_TEXT]**, **[ADJUSTMENT_REQUESTS]** and **[COVER_LETTER_TEXT]** are
+            given in the next message.
 
             ### Verification Constraints (CRITICAL)
 
@@ -193,31 +391,49 @@ class OpenAiAgent:
             ```
             [The complete, verified, and adjusted cover letter text]
             ```
+
+            ### **[ORIGINAL_RESUME_TEXT]:** (Used for re-verification)
+                ---
+                {original_resume}
+                ---
             """
-        
-        response = self.client.chat.completions.create(
-        model=self.model,
-        messages=[
-                {
-                    "role": "system",
-                    "content": (
-                    "You are a professional editor and compliance specialist. "
-                        "Your sole task is to verify and adjust the provided cover letter text. "
-                        "Your response must ONLY be the final, verified, and adjusted cover letter. "
-                        "Strictly adhere to all constraints, especially the 'NO SKILLS FABRICATION' rule."
-                    )
-                },
-                {"role": "user", "content": prompt}
-            ]
-        )
 
-        final_coverletter = response.choices[0].message.content.strip().replace('-', '')
-        return final_coverletter
+        prompt = f"""
+            1.  **[ORIGINAL_JOB_DESCRIPTION_TEXT]:** (Used for context)
+                ---
+                {original_job_description}
+                ---
+            2.  **[ADJUSTMENT_REQUESTS]:**
+                ---
+                {adjustment_requests or "No specific adjustments provided. Focus only on verification and minor flow improvements."}
+                ---
+            3.  **[COVER_LETTER_TEXT]:** (The letter to be edited)
+                ---
+                {cover_letter_text}
+                ---
+            """
 
-    def write_email_contents(self):
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                "You are a professional editor and compliance specialist. "
+                    "Your sole task is to verify and adjust the provided cover letter text. "
+                    "Your response must ONLY be the final, verified, and adjusted cover letter. "
+                    "Strictly adhere to all constraints, especially the 'NO SKILLS FABRICATION' rule."
+                )
+            },
+            {"role": "user", "content": instructions},
+            {"role": "user", "content": prompt}
+        ]
+        return messages
+
+    def write_email_template(self):
         email_prompt = f"""
-            **Task:** Write a short, polite cold email to a recruiter.
+            **Task:** Write a short, polite cold email to a recruiter about a job application.
             The email must mention that the resume and cover letter are attached.
+            Refer to the role only as {{position}} and to the company only as {{company}}, written exactly like that
+            including the curly braces, they are filled in later. Do not use any other placeholders.
             Do not include a subject line.
 
             **Required Output Format (Strictly follow this):**
@@ -227,9 +443,8 @@ class OpenAiAgent:
             {self.name}
         """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
+        response = self._complete(
+            [
                 {
                     "role": "system",
                     "content": (
@@ -241,17 +456,30 @@ class OpenAiAgent:
                     )
                 },
                 {"role": "user", "content": email_prompt}
-            ]
+            ],
+            "email_template"
         )
 
-        email_text = response.choices[0].message.content.strip()
-        return email_text
+        return response.choices[0].message.content.strip()
 
 
 class MetaAgent:
-    def __init__(self, name):
-        self.client = MetaAI()
+    def __init__(self, name, rate_limit=None):
+        self._client = None
         self.name = name
+        self.rate_limit = rate_limit or RateLimiter()["metaai"]
+
+    @property
+    def client(self):
+        # MetaAI fetches session cookies when constructed, so defer it until the first prompt
+        if self._client is None:
+            from meta_ai_api import MetaAI
+            self._client = MetaAI()
+        return self._client
+
+    def _prompt(self, message, **kwargs):
+        with self.rate_limit.limit():
+            return self.client.prompt(message=message, **kwargs)
     
     def prepare_cover_letter(self, job_data, resume, convert_to_australian_language):
         job_description = job_data.get('content', '').get('sections', '')
@@ -275,20 +503,25 @@ class MetaAgent:
             treat this as a final copy & only return the contents of the email
             """
         
-        initial_cover = self.client.prompt(message=prompt, new_conversation=True)
+        initial_cover = self._prompt(prompt, new_conversation=True)
 
         cleaned_letter = re.sub(rf".*?(Dear .*?Best Regards\n{self.name}\n).*", r"\1", initial_cover['message'], flags=re.DOTALL)
         return cleaned_letter
 
-    def write_email_contents(self):
-        email_content = self.client.prompt(message=f"""
-            Now write the contents of the email, I have scraped these email of these recruiters so keep the cold email brief and to the point, I will also be attaching my resume and cover letter
+    async def aprepare_cover_letter(self, job_data, resume, convert_to_australian_language):
+        # meta_ai_api only has a blocking client
+        return await asyncio.to_thread(self.prepare_cover_letter, job_data, resume, convert_to_australian_language)
+
+    def write_email_template(self):
+        email_content = self._prompt(f"""
+            Write the contents of a brief cold email to a recruiter, I will be attaching my resume and cover letter
+            refer to the role only as {{position}} and to the company only as {{company}}, written exactly like that including the curly braces
             format the email in as follows & exclude a subject:
-            Dear first name
+            Dear Hiring Manager
             contents of email
             Best Regards
             {self.name}
-        """)
+        """, new_conversation=True)
 
         cleaned_email_content = re.sub(rf".*?(Dear .*?Best Regards\n{self.name}\n).*", r"\1", email_content['message'], flags=re.DOTALL)
         return cleaned_email_content
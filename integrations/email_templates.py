@@ -0,0 +1,62 @@
+from common.utils import load_json_file, write_json_file
+from datetime import date
+import threading
+import logging
+import random
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+
+# Placeholders the agents are asked to leave in templates, filled in per job
+POSITION_PLACEHOLDER = "{position}"
+COMPANY_PLACEHOLDER = "{company}"
+
+
+class EmailTemplates:
+    # Recruiter emails barely depend on the job, so a few variants are written once a day
+    # and reused for every recipient with the job fields filled in locally
+    def __init__(self, path, variants=3):
+        self.path = path
+        self.variants = variants
+        self.data = load_json_file(path) or {}
+        self._lock = threading.Lock()
+
+    def _key(self, agent):
+        return f"{type(agent).__name__}:{agent.name}"
+
+    def _current(self, agent):
+        if self.data.get('date') != date.today().isoformat() or self.data.get('agent') != self._key(agent):
+            return []
+        return self.data.get('templates', [])
+
+    def render(self, agent, job):
+        # Returns None when today's templates haven't been written yet, see refresh
+        templates = self._current(agent)
+        if not templates:
+            return None
+        position = job.get('title') or 'advertised'
+        company_name = (job.get('companyProfile') or {}).get('name') or 'your company'
+        template = random.choice(templates)
+        return template.replace(POSITION_PLACEHOLDER, position).replace(COMPANY_PLACEHOLDER, company_name)
+
+    def refresh(self, agent):
+        # Blocking, run it off the event loop. Concurrent callers wait for the first one to finish
+        with self._lock:
+            if self._current(agent):
+                return
+            templates = []
+            for _ in range(self.variants):
+                try:
+                    template = agent.write_email_template()
+                except Exception as e:
+                    logging.error(f"Error writing email template: {e}")
+                    continue
+                if template:
+                    templates.append(template)
+            if not templates:
+                return
+            self.data = {'date': date.today().isoformat(), 'agent': self._key(agent), 'templates': templates}
+            write_json_file(self.path, self.data)
+            logging.info(f"Wrote {len(templates)} email templates for today")
@@ -1,14 +1,18 @@
 from email.mime.multipart import MIMEMultipart
+from common.rate_limiter import RateLimiter
 from email.header import decode_header
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from dotenv import load_dotenv
 from email import encoders
 from pathlib import Path
+import threading
 import logging
 import imaplib
 import smtplib
 import email
+import queue
+import time
 import re
 import os
 
@@ -19,12 +23,108 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
 )
 
+class SMTPConnectionPool:
+    # Connections idle for longer than this are checked with a NOOP before reuse
+    KEEPALIVE_CHECK = 30
+
+    def __init__(self, host, port, user_email, app_password, max_connections=1):
+        self.host = host
+        self.port = port
+        self.user_email = user_email
+        self.app_password = app_password
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=60)
+        try:
+            server.starttls()
+            server.login(self.user_email, self.app_password)
+        except Exception:
+            self._quit(server)
+            raise
+        return server
+
+    def _quit(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _is_alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - last_used < self.KEEPALIVE_CHECK or self._is_alive(server):
+                    return server
+                self._quit(server)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, server):
+        self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def send_message(self, msg):
+        server = self._checkout()
+        try:
+            try:
+                server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server dropped the connection while it sat in the pool, reconnect and retry once
+                logging.info("SMTP connection was closed by the server, reconnecting")
+                self._quit(server)
+                server = self._connect()
+                server.send_message(msg)
+        except Exception:
+            self._quit(server)
+            self._slots.release()
+            raise
+        self._checkin(server)
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(server)
+
+
 class MailClient:
-    def __init__(self, mail_protocol):
+    def __init__(self, mail_protocol, rate_limit=None, max_connections=1):
         self.user_email = os.getenv("EMAIL_ADDRESS")
         self.app_password = os.getenv("EMAIL_APP_PASSWORD")
         self.mail_protocol = mail_protocol
         self.smtp_port = 587
+        self.rate_limit = rate_limit or RateLimiter()["smtp"]
+        self.smtp_pool = SMTPConnectionPool(
+            f'smtp.{self.mail_protocol}',
+            self.smtp_port,
+            self.user_email,
+            self.app_password,
+            max_connections
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.smtp_pool.close()
     
     def send_application(self, recipient_email, job_data, email_body, resume_path, cover_letter_path):
         try:
@@ -44,13 +144,15 @@ class MailClient:
             logging.error(f"Failed to send email: {e}")
             return False
 
-    def send_notification(self, recipient_email, subject, body):
+    def send_notification(self, recipient_email, subject, body, html_body=None):
         try:
-            msg = MIMEMultipart()
+            msg = MIMEMultipart('alternative' if html_body else 'mixed')
             msg['From'] = self.user_email
             msg['To'] = recipient_email
             msg['Subject'] = subject
             msg.attach(MIMEText(body, 'plain'))
+            if html_body:
+                msg.attach(MIMEText(html_body, 'html'))
             self._send_email(msg)
             logging.info("Successfully sent notification email")
             return True
@@ -90,10 +192,8 @@ class MailClient:
         return msg
     
     def _send_email(self, msg):
-        with smtplib.SMTP(f'smtp.{self.mail_protocol}', self.smtp_port) as server:
-            server.starttls()
-            server.login(self.user_email, self.app_password)
-            server.send_message(msg)
+        with self.rate_limit.limit():
+            self.smtp_pool.send_message(msg)
     
     def parse_code(self, text):
         match = re.search(r"\b\d{6}\b", text)
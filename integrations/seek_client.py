@@ -1,39 +1,77 @@
 from common.utils import load_json_file, write_json_file
 from integrations.mail_handler import MailClient
-from requests_toolbelt import MultipartEncoder
+from common.rate_limiter import RateLimiter
 from urllib.parse import urlparse, parse_qs
-from curl_cffi import requests
 from dotenv import load_dotenv
+import hashlib
 import logging
+import asyncio
+import random
 import uuid
 import time
 import os
+import re
 
 load_dotenv()
 
+# Error messages seek answers a process mutation with while the uploaded file is still being scanned
+NOT_READY_PATTERN = re.compile(r'not (yet )?(ready|processed|available|found)|still processing|pending|in progress', re.IGNORECASE)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
 )
 
 
-class SeekClient:
+class BaseSeekClient:
+    # Payloads, response parsing and caches, the requests themselves are made by AsyncSeekClient
     AUTH0_CLIENT = 'eyJuYW1lIjoiYXV0aDAuanMiLCJ2ZXJzaW9uIjoiOS4yOC4wIn0='
     CLIENT_ID = "yGBVge66K5NJpSN5u71fU90VcTlEASNu"
     SEEK_LOGIN_SENDER = "noreply@seek.com.au"
     USER_EMAIL = os.getenv("EMAIL_ADDRESS")
     REFRESH_TOKEN_PATH = "credentials/seek_refresh_token.json"
-
-    def __init__(self, mail_client: MailClient):
+    ATTACHMENT_CACHE_PATH = "credentials/seek_attachments.json"
+    GRAPHQL_URL = 'https://www.seek.com.au/graphql'
+    TOKEN_URL = 'https://login.seek.com/oauth/token'
+    # Uploaded documents stay on the seek profile, re-upload now and then in case old uris are purged
+    ATTACHMENT_TTL = 7 * 24 * 60 * 60
+    # The profile doesn't change during a run, the ttl only matters for long lived clients
+    PROFILE_TTL = 60 * 60
+    # Seek processes uploads asynchronously, a process mutation answering "not ready" is retried with backoff
+    # up to the timeout. Any other error fails the upload, the mutation isn't idempotent so it isn't re-sent blindly
+    PROCESS_POLL_INITIAL = 0.5
+    PROCESS_POLL_MAX = 4
+    PROCESS_TIMEOUT = 30
+
+    def __init__(self, mail_client: MailClient, rate_limit=None):
         self.mail_client = mail_client
         self.is_logged_in = False
-    
-    def __enter__(self):
-        headers = {
+        self.rate_limit = rate_limit or RateLimiter()["seek"]
+        self.session = None
+        self.refresh_token = None
+        self.access_token = None
+        self.token_expiry = 0
+        self.attachment_cache = {}
+        self.most_recent_role = None
+        self.profile_fetched_at = 0
+
+    def _batch(self, operations):
+        # Seek's graphql endpoint takes a list of operations, independent ones share a single request
+        return [operation for json_data in operations for operation in json_data]
+
+    def _unbatch(self, data, operations):
+        responses = []
+        start = 0
+        for json_data in operations:
+            responses.append(data[start:start + len(json_data)])
+            start += len(json_data)
+        return responses
+
+    def _session_headers(self):
+        return {
             'accept': '*/*',
             'accept-language': 'en-US,en;q=0.6',
             'auth0-client': self.AUTH0_CLIENT,
-            'content-type': 'application/json',
             'origin': 'https://login.seek.com',
             'priority': 'u=1, i',
             'referer': 'https://login.seek.com/',
@@ -48,240 +86,190 @@ class SeekClient:
             'x-request-language': 'en-au',
         }
 
-        self.session = requests.Session(impersonate="chrome", headers=headers, allow_redirects=True)
+    def _load_credentials(self):
         self.refresh_token = load_json_file(self.REFRESH_TOKEN_PATH).get("refresh_token")
-        return self
+        self.attachment_cache = {
+            key: entry for key, entry in load_json_file(self.ATTACHMENT_CACHE_PATH).items()
+            if time.time() - entry.get('uploaded_at', 0) < self.ATTACHMENT_TTL
+        }
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        if self.session:
-            self.session.close()
+    def _save_credentials(self):
         if self.refresh_token:
             write_json_file(self.REFRESH_TOKEN_PATH, {"refresh_token": self.refresh_token})
 
-    def login(self):
-        try:
-            if self.refresh_token:
-                success = self._renew_token()
-                if success:
-                    self.is_logged_in = True
-                    return success
+    def _auth_headers(self):
+        # Sent per graphql request rather than set on the session, so the same session can post uploads to S3
+        return {'authorization': f'Bearer {self.access_token}'}
 
-            json_data = {
-                'client_id': self.CLIENT_ID,
-                'connection': 'email',
-                'send': 'link',
-                'email': self.USER_EMAIL,
-                'authParams': {
-                    'response_type': 'code',
-                    'redirect_uri': 'https://www.seek.com.au/oauth/callback/',
-                    'scope': 'openid profile email offline_access',
-                    'audience': 'https://seek/api/candidate',
-                },
-            }
-            response = self.session.post('https://login.seek.com/passwordless/start', json=json_data)
-            response.raise_for_status()
-            logging.info("Waiting 5 seconds for login code email to arrive")
-            time.sleep(5)
-
-            code = self.mail_client.fetch_code(self.SEEK_LOGIN_SENDER)
-            json_data = {
-                'connection': 'email',
-                'verification_code': code,
-                'email': self.USER_EMAIL,
-                'client_id': self.CLIENT_ID,
-            }
+    def _token_expiring(self):
+        return time.time() > self.token_expiry - 300
 
-            response = self.session.post('https://login.seek.com/passwordless/verify', json=json_data)
-            response.raise_for_status()
-            params = {
-                'client_id': self.CLIENT_ID,
+    def _store_token(self, data):
+        if not data.get('access_token'):
+            raise ValueError("No access_token in response")
+        self.access_token = data.get('access_token')
+        self.refresh_token = data.get('refresh_token')
+        self.token_expiry = time.time() + data.get('expires_in', 0)
+
+    def _passwordless_start_payload(self):
+        return {
+            'client_id': self.CLIENT_ID,
+            'connection': 'email',
+            'send': 'link',
+            'email': self.USER_EMAIL,
+            'authParams': {
                 'response_type': 'code',
                 'redirect_uri': 'https://www.seek.com.au/oauth/callback/',
                 'scope': 'openid profile email offline_access',
                 'audience': 'https://seek/api/candidate',
-                '_intstate': 'deprecated',
-                'protocol': 'oauth2',
-                'connection': 'email',
-                'verification_code': code,
-                'email': self.USER_EMAIL,
-                'auth0Client': self.AUTH0_CLIENT,
-            }
-            
-            response = self.session.get('https://login.seek.com/passwordless/verify_redirect', params=params)
-            response.raise_for_status()
-            auth_code = self._parse_auth_code(response.url)
-
-            if not auth_code:
-                logging.error("Authorization code not found, cannot proceed")
-                return
-            
-            json_data = {
-                'client_id': self.CLIENT_ID,
-                'code': auth_code,
-                'grant_type': 'authorization_code',
-                'redirect_uri': 'https://www.seek.com.au/oauth/callback/',
-            }
-
-            response = self.session.post('https://login.seek.com/oauth/token', json=json_data)
-            response.raise_for_status()
-            data = response.json()
-            self.refresh_token = data.get('refresh_token')
-            self.token_expiry = time.time() + data.get('expires_in', 0)
-            self.session.headers.update({'authorization': f'Bearer {data.get('access_token')}'})
-            self.is_logged_in = True
-            logging.info("Successfully logged in to seek")
-            return True
+            },
+        }
 
-        except Exception as e:
-            logging.error(f"Error during login: {e}")
-            return False
+    def _passwordless_verify_payload(self, code):
+        return {
+            'connection': 'email',
+            'verification_code': code,
+            'email': self.USER_EMAIL,
+            'client_id': self.CLIENT_ID,
+        }
 
-    def _check_and_renew(self):
-        if not self.is_logged_in:
-            success = self.login()
-            return success
-        
-        if time.time() > self.token_expiry - 300:
-            success = self._renew_token()
-            return success
+    def _verify_redirect_params(self, code):
+        return {
+            'client_id': self.CLIENT_ID,
+            'response_type': 'code',
+            'redirect_uri': 'https://www.seek.com.au/oauth/callback/',
+            'scope': 'openid profile email offline_access',
+            'audience': 'https://seek/api/candidate',
+            '_intstate': 'deprecated',
+            'protocol': 'oauth2',
+            'connection': 'email',
+            'verification_code': code,
+            'email': self.USER_EMAIL,
+            'auth0Client': self.AUTH0_CLIENT,
+        }
 
-        return True
+    def _authorization_code_payload(self, auth_code):
+        return {
+            'client_id': self.CLIENT_ID,
+            'code': auth_code,
+            'grant_type': 'authorization_code',
+            'redirect_uri': 'https://www.seek.com.au/oauth/callback/',
+        }
 
-    def _renew_token(self):
-        json_data = {
+    def _refresh_token_payload(self):
+        return {
             'client_id': self.CLIENT_ID,
             'refresh_token': self.refresh_token,
             'grant_type': 'refresh_token',
         }
-        try:
-            response = self.session.post('https://login.seek.com/oauth/token', json=json_data)
-            response.raise_for_status()
-            data = response.json()
-
-            if not data.get('access_token'):
-                raise ValueError("No access_token in response")
-            
-            self.session.headers.update({'authorization': f'Bearer {data.get('access_token')}'})
-            self.refresh_token = data.get('refresh_token')
-            self.token_expiry = time.time() + data.get('expires_in', 0)
-            return True
-        except Exception as e:
-            logging.error(f'Error refreshing token {e}')
-            self.is_logged_in = False
-            return False
 
     def _parse_auth_code(self, url):
-        if "code=" in url:            
+        if "code=" in url:
             parsed_url = urlparse(url)
             params = parse_qs(parsed_url.query)
-            
+
             auth_code = params.get('code', [None])[0]
             return auth_code
         return
 
-    def apply(self, job_id, resume_path, cover_letter_path, show_recent_role=True):
-        try:
-            if not self._check_and_renew():
-                return False
-
-            resume_uri = self._upload_attachment('Resume', resume_path)
-            cover_letter_uri = self._upload_attachment('CoverLetter', cover_letter_path)
-            if show_recent_role:
-                recent_role = self.get_most_recent_role()
-            else:
-                recent_role = {}
-            
-            json_data = [
-                {
-                    'operationName': 'ApplySubmitApplication',
-                    'variables': {
-                        'input': {
-                            'jobId': job_id,
-                            'correlationId': str(uuid.uuid4()),
-                            'zone': 'anz-1',
-                            'profilePrivacyLevel': 'Standard',
-                            'resume': {
-                                'uri': resume_uri,
-                            },
-                            'coverLetter': {
-                                'uri': cover_letter_uri,
-                            },
-                            'mostRecentRole': recent_role
+    def _submit_application(self, job_id, resume_uri, cover_letter_uri, recent_role):
+        json_data = [
+            {
+                'operationName': 'ApplySubmitApplication',
+                'variables': {
+                    'input': {
+                        'jobId': job_id,
+                        'correlationId': str(uuid.uuid4()),
+                        'zone': 'anz-1',
+                        'profilePrivacyLevel': 'Standard',
+                        'resume': {
+                            'uri': resume_uri,
                         },
-                        'locale': 'en-AU',
+                        'coverLetter': {
+                            'uri': cover_letter_uri,
+                        },
+                        'mostRecentRole': recent_role
                     },
-                    'query': 'mutation ApplySubmitApplication($input: SubmitApplicationInput!, $locale: Locale) {\n  submitApplication(input: $input) {\n    ... on SubmitApplicationSuccess {\n      applicationId\n      __typename\n    }\n    ... on SubmitApplicationFailure {\n      errors {\n        message(locale: $locale)\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}',
+                    'locale': 'en-AU',
                 },
-            ]
+                'query': 'mutation ApplySubmitApplication($input: SubmitApplicationInput!, $locale: Locale) {\n  submitApplication(input: $input) {\n    ... on SubmitApplicationSuccess {\n      applicationId\n      __typename\n    }\n    ... on SubmitApplicationFailure {\n      errors {\n        message(locale: $locale)\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}',
+            },
+        ]
+        return json_data
 
-            response = self.session.post('https://www.seek.com.au/graphql', json=json_data)
-            # logging.info(f"Application response: {response.text}")
-            response.raise_for_status()
-            data = response.json()
-            assert data[0]['data']['submitApplication']['__typename'] == 'SubmitApplicationSuccess', f"Application failed: {data[0]['data']['submitApplication'].get('errors', [])}"
-            logging.info(f"Successfully processed application via seek")
-            return True
-        except Exception as e:
-            logging.error(f"Error during job application: {e}")
-            return False
+    def _check_submission(self, data):
+        assert data[0]['data']['submitApplication']['__typename'] == 'SubmitApplicationSuccess', f"Application failed: {data[0]['data']['submitApplication'].get('errors', [])}"
 
-    def _upload_attachment(self, type, file_path):
-        try:
-            actual_filename = os.path.basename(file_path)
-            json_data = [
-                {
-                    'operationName': 'GetDocumentUploadData',
-                    'variables': {
-                        'id': str(uuid.uuid4()),
-                    },
-                    'query': 'query GetDocumentUploadData($id: UUID!) {\n  viewer {\n    documentUploadFormData(id: $id) {\n      link\n      key\n      formFields {\n        key\n        value\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}',
+    def _document_upload_data(self):
+        json_data = [
+            {
+                'operationName': 'GetDocumentUploadData',
+                'variables': {
+                    'id': str(uuid.uuid4()),
                 },
-            ]
-
-            response = self.session.post('https://www.seek.com.au/graphql', json=json_data)
-            response.raise_for_status()
-            response_data = response.json()
-            document_form_data = response_data[0]['data']['viewer']['documentUploadFormData']
-            link = document_form_data['link']
-            uuid_key = document_form_data['key']
-            
-            fields = {item['key']: item['value'].replace('${filename}', actual_filename) if '${filename}' in item['value'] else item['value'] 
-                    for item in document_form_data['formFields']}
-            with open(file_path, 'rb') as f:
-                fields['file'] = (actual_filename, f, 'application/pdf')
-                mp = MultipartEncoder(fields=fields)
-
-                response = requests.post(
-                    link,
-                    data=mp.to_string(),
-                    headers={'Content-Type': mp.content_type}
-                    
-                )
+                'query': 'query GetDocumentUploadData($id: UUID!) {\n  viewer {\n    documentUploadFormData(id: $id) {\n      link\n      key\n      formFields {\n        key\n        value\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}',
+            },
+        ]
+        return json_data
 
-            response.raise_for_status()
-            time.sleep(5)
-            
-            if type == "CoverLetter":
-                json_data = self._process_cover_letter(uuid_key)
-            elif type == "Resume":
-                json_data = self._process_resume(uuid_key)
-            else:
-                raise ValueError("Invalid attachment type")
-            
-            response = self.session.post('https://www.seek.com.au/graphql', json=json_data)
-            response.raise_for_status()
-            data = response.json()
+    def _upload_fields(self, response_data, file_path):
+        actual_filename = os.path.basename(file_path)
+        document_form_data = response_data[0]['data']['viewer']['documentUploadFormData']
+        fields = {item['key']: item['value'].replace('${filename}', actual_filename) if '${filename}' in item['value'] else item['value']
+                for item in document_form_data['formFields']}
+        return document_form_data['link'], document_form_data['key'], fields
+
+    def _multipart(self, fields, file_path):
+        from curl_cffi import CurlMime
+
+        # libcurl streams the file from disk while sending, the request body is never built in memory
+        mime = CurlMime()
+        for key, value in fields.items():
+            mime.addpart(name=key, data=value.encode('utf-8'))
+        # S3 ignores form fields that come after the file, so it goes last
+        mime.addpart(name='file', content_type='application/pdf', filename=os.path.basename(file_path), local_path=file_path)
+        return mime
+
+    def _process_attachment(self, type, uuid_key, parsing_context):
+        if type == "CoverLetter":
+            return self._process_cover_letter(uuid_key)
+        elif type == "Resume":
+            return self._process_resume(uuid_key, parsing_context)
+        raise ValueError("Invalid attachment type")
+
+    def _processed_uri(self, type, data):
+        try:
             if type == "CoverLetter":
-                uri = data[0]['data']['processUploadedAttachment']['uri']
-            elif type == "Resume":
-                uri = data[0]['data']['processUploadedResume']['resume']['fileMetadata']['uri']
-            
-            return uri
-        except Exception as e:
-            logging.error(f"Error during attachment upload: {e}")
+                return data[0]['data']['processUploadedAttachment']['uri']
+            return data[0]['data']['processUploadedResume']['resume']['fileMetadata']['uri']
+        except (KeyError, IndexError, TypeError):
             return None
 
-    def _process_resume(self, uuid_key):
+    def _error_messages(self, errors):
+        return "; ".join(error.get('message', '') for type_errors in errors.values() for error in type_errors)
+
+    def _not_ready(self, data):
+        # Only an explicit "still processing" answer is worth asking again, anything else is a real failure
+        errors = data[0].get('errors') if data else None
+        if not errors:
+            return False
+        return all(NOT_READY_PATTERN.search(error.get('message', '')) for error in errors)
+
+    def _next_poll(self, errors, started, delay):
+        # Returns how long to sleep before polling again, full jitter keeps concurrent uploads out of lockstep
+        waited = time.monotonic() - started
+        if waited + delay > self.PROCESS_TIMEOUT:
+            raise TimeoutError(f"{', '.join(errors)} not processed after {waited:.1f}s: {self._error_messages(errors)}")
+        return random.uniform(0, delay), min(delay * 2, self.PROCESS_POLL_MAX)
+
+    def _record_processed(self, type, uri, started, timings):
+        waited = time.monotonic() - started
+        logging.info(f"{type} was processed by seek after {waited:.1f}s")
+        if timings is not None:
+            timings[type] = round(waited, 2)
+        return uri
+
+    def _process_resume(self, uuid_key, parsing_context):
         json_data = [
             {
                 'operationName': 'ApplyProcessUploadedResume',
@@ -290,7 +278,7 @@ class SeekClient:
                         'id': uuid_key,
                         'isDefault': False,
                         'parsingContext': {
-                            'id': str(uuid.uuid4()),
+                            'id': parsing_context,
                         },
                         'zone': 'anz-1',
                     },
@@ -314,8 +302,269 @@ class SeekClient:
             },
         ]
         return json_data
-    
-    def handle_role_requirements(self, job_id):
+
+    def _get_roles(self):
+        json_data = [
+            {
+                'operationName': 'GetRoles',
+                'variables': {},
+                'query': 'query GetRoles {\n  viewer {\n    _id\n    roles {\n      ...role\n      __typename\n    }\n    yearsOfExperience {\n      newToWorkforce\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment role on Role {\n  id\n  title {\n    text\n    ontologyId\n    __typename\n  }\n  company {\n    text\n    ontologyId\n    __typename\n  }\n  seniority {\n    text\n    ontologyId\n    __typename\n  }\n  from {\n    year\n    month\n    __typename\n  }\n  to {\n    year\n    month\n    __typename\n  }\n  achievements\n  tracking {\n    events {\n      key\n      value\n      __typename\n    }\n    __typename\n  }\n  __typename\n}',
+            }
+        ]
+        return json_data
+
+    def _parse_most_recent_role(self, data):
+        roles = data[0]['data']['viewer']['roles']
+        if roles:
+            most_recent_role = {
+                'company': roles[0]['company']['text'] if roles[0]['company'] else '',
+                'title': roles[0]['title']['text'] if roles[0]['title'] else '',
+                'started': {
+                    "year": roles[0]['from']['year'] if roles[0]['from'] else '',
+                    "month": roles[0]['from']['month'] if roles[0]['from'] else '',
+                },
+            }
+            if roles[0]['to']:
+                most_recent_role['finished'] = {
+                    "year": roles[0]['to']['year'] if roles[0]['to'] else '',
+                    "month": roles[0]['to']['month'] if roles[0]['to'] else '',
+                }
+            return most_recent_role
+        return {}
+
+    def _cached_role(self):
+        if self.most_recent_role is not None and time.time() - self.profile_fetched_at < self.PROFILE_TTL:
+            return self.most_recent_role
+        return None
+
+    def _store_roles(self, data):
+        try:
+            # TODO: check response for errors as status always seems to be 200
+            self._cache_role(self._parse_most_recent_role(data))
+        except Exception as e:
+            logging.error(f"Error fetching most recent role: {e}")
+
+    def _cache_role(self, role):
+        if role is not None:
+            self.most_recent_role = role
+            self.profile_fetched_at = time.time()
+        return role
+
+    def _file_hash(self, file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _attachment_key(self, type, file_path):
+        return f"{type}:{self._file_hash(file_path)}"
+
+    def _cached_uri(self, key):
+        entry = self.attachment_cache.get(key)
+        if entry and time.time() - entry['uploaded_at'] < self.ATTACHMENT_TTL:
+            return entry['uri']
+        return None
+
+    def _cache_uri(self, key, uri):
+        if uri:
+            self.attachment_cache[key] = {'uri': uri, 'uploaded_at': time.time()}
+            write_json_file(self.ATTACHMENT_CACHE_PATH, self.attachment_cache)
+        return uri
+
+    def _drop_uri(self, key):
+        if self.attachment_cache.pop(key, None):
+            write_json_file(self.ATTACHMENT_CACHE_PATH, self.attachment_cache)
+
+
+class AsyncSeekClient(BaseSeekClient):
+    # Runs every request on one pooled AsyncSession so several applications can be in flight on the event loop
+    def __init__(self, mail_client: MailClient, rate_limit=None, max_connections=10):
+        super().__init__(mail_client, rate_limit)
+        self.max_connections = max_connections
+        self._auth_lock = asyncio.Lock()
+        self._attachment_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        from curl_cffi.requests import AsyncSession
+
+        self.session = AsyncSession(impersonate="chrome", headers=self._session_headers(), allow_redirects=True, max_clients=self.max_connections)
+        self._load_credentials()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.session:
+            await self.session.close()
+        self._save_credentials()
+
+    async def login(self):
+        async with self._auth_lock:
+            return await self._login()
+
+    async def _login(self):
+        try:
+            if self.refresh_token:
+                success = await self._renew_token()
+                if success:
+                    self.is_logged_in = True
+                    return success
+
+            response = await self.session.post('https://login.seek.com/passwordless/start', json=self._passwordless_start_payload())
+            response.raise_for_status()
+            logging.info("Waiting 5 seconds for login code email to arrive")
+            await asyncio.sleep(5)
+
+            code = await asyncio.to_thread(self.mail_client.fetch_code, self.SEEK_LOGIN_SENDER)
+            response = await self.session.post('https://login.seek.com/passwordless/verify', json=self._passwordless_verify_payload(code))
+            response.raise_for_status()
+
+            response = await self.session.get('https://login.seek.com/passwordless/verify_redirect', params=self._verify_redirect_params(code))
+            response.raise_for_status()
+            auth_code = self._parse_auth_code(response.url)
+
+            if not auth_code:
+                logging.error("Authorization code not found, cannot proceed")
+                return
+
+            response = await self.session.post(self.TOKEN_URL, json=self._authorization_code_payload(auth_code))
+            response.raise_for_status()
+            self._store_token(response.json())
+            self.is_logged_in = True
+            logging.info("Successfully logged in to seek")
+            return True
+
+        except Exception as e:
+            logging.error(f"Error during login: {e}")
+            return False
+
+    async def _check_and_renew(self):
+        if self.is_logged_in and not self._token_expiring():
+            return True
+
+        # Only the first caller refreshes, the others find a valid token once they get the lock
+        async with self._auth_lock:
+            if not self.is_logged_in:
+                return await self._login()
+            if self._token_expiring():
+                return await self._renew_token()
+            return True
+
+    async def _renew_token(self):
+        try:
+            response = await self.session.post(self.TOKEN_URL, json=self._refresh_token_payload())
+            response.raise_for_status()
+            self._store_token(response.json())
+            return True
+        except Exception as e:
+            logging.error(f'Error refreshing token {e}')
+            self.is_logged_in = False
+            return False
+
+    async def _graphql(self, json_data):
+        async with self.rate_limit.alimit():
+            response = await self.session.post(self.GRAPHQL_URL, json=json_data, headers=self._auth_headers())
+            response.raise_for_status()
+        return response.json()
+
+    async def _graphql_batch(self, operations):
+        return self._unbatch(await self._graphql(self._batch(operations)), operations)
+
+    async def apply(self, job_id, resume_path, cover_letter_path, show_recent_role=True, timings=None):
+        try:
+            if not await self._check_and_renew():
+                return False
+
+            resume_key = await asyncio.to_thread(self._attachment_key, 'Resume', resume_path)
+            # The per job cover letter uploads alongside the shared resume instead of waiting on its lock
+            (resume_uri, resume_cached), uris = await asyncio.gather(
+                self._resume_uri(resume_key, resume_path, timings),
+                self._upload_attachments({'CoverLetter': cover_letter_path}, timings, show_recent_role),
+            )
+
+            if show_recent_role:
+                recent_role = await self.get_most_recent_role()
+            else:
+                recent_role = {}
+
+            data = await self._graphql(self._submit_application(job_id, resume_uri, uris['CoverLetter'], recent_role))
+            try:
+                self._check_submission(data)
+            except AssertionError:
+                # A rejected submission with a fresh cover letter points at the cached resume uri, upload it again next time
+                if resume_cached:
+                    await self._forget_attachment(resume_key)
+                raise
+            logging.info(f"Successfully processed application via seek")
+            return True
+        except Exception as e:
+            logging.error(f"Error during job application: {e}")
+            return False
+
+    async def _resume_uri(self, resume_key, resume_path, timings=None):
+        # Returns the uri and whether it came from the cache. The lock is only held while the shared
+        # resume is uploaded, so concurrent applications wait for it instead of each uploading their own
+        async with self._attachment_lock:
+            resume_uri = self._cached_uri(resume_key)
+            if resume_uri is not None:
+                return resume_uri, True
+            uris = await self._upload_attachments({'Resume': resume_path}, timings)
+            return self._cache_uri(resume_key, uris['Resume']), False
+
+    async def _forget_attachment(self, key):
+        async with self._attachment_lock:
+            self._drop_uri(key)
+
+    async def _upload_attachments(self, attachments, timings=None, fetch_roles=False):
+        operations = [self._document_upload_data() for _ in attachments]
+        fetch_roles = fetch_roles and self._cached_role() is None
+        if fetch_roles:
+            operations.append(self._get_roles())
+        responses = await self._graphql_batch(operations)
+        if fetch_roles:
+            self._store_roles(responses.pop())
+
+        uploads = [self._upload_fields(response, file_path) for file_path, response in zip(attachments.values(), responses)]
+        await asyncio.gather(*(
+            self._post_file(link, fields, file_path)
+            for (link, _, fields), file_path in zip(uploads, attachments.values())
+        ))
+        pending = {type: uuid_key for type, (_, uuid_key, _) in zip(attachments, uploads)}
+        return await self._wait_for_processing(pending, timings)
+
+    async def _post_file(self, link, fields, file_path):
+        mime = self._multipart(fields, file_path)
+        try:
+            response = await self.session.post(link, multipart=mime)
+            response.raise_for_status()
+        finally:
+            mime.close()
+
+    async def _wait_for_processing(self, pending, timings=None):
+        started = time.monotonic()
+        delay = self.PROCESS_POLL_INITIAL
+        # Retries reuse the same parsing context so seek sees them as one resume parse
+        contexts = {type: str(uuid.uuid4()) for type in pending}
+        uris = {}
+        while True:
+            types = list(pending)
+            responses = await self._graphql_batch([self._process_attachment(type, pending[type], contexts[type]) for type in types])
+            errors = {}
+            for type, data in zip(types, responses):
+                uri = self._processed_uri(type, data)
+                if uri:
+                    uris[type] = self._record_processed(type, uri, started, timings)
+                    del pending[type]
+                elif self._not_ready(data):
+                    errors[type] = data[0]['errors']
+                else:
+                    failed = {type: data[0].get('errors', []) if data else []}
+                    raise RuntimeError(f"{type} processing failed: {self._error_messages(failed) or 'no uri returned'}")
+            if not pending:
+                return uris
+            sleep, delay = self._next_poll(errors, started, delay)
+            await asyncio.sleep(sleep)
+
+    async def handle_role_requirements(self, job_id):
         # Not yet implemented
         try:
             json_data = [
@@ -330,57 +579,33 @@ class SeekClient:
                 },
             ]
 
-            response = self.session.post('https://www.seek.com.au/graphql', json=json_data)
             # TODO: check response for errors as status always seems to be 200
-            response.raise_for_status()
-            data = response.json()
+            data = await self._graphql(json_data)
             questions = data[0]['data']['jobApplicationProcess']['questionnaire']['questions']
             options = {}
             for question in questions:
                 options[f"{question['id']--question['text']}"] = [(option['id'], option['text']) for option in question.get('options', [])]
-            
+
 
         except Exception as e:
             logging.error(f"Error during role requirements handling: {e}")
 
-    def get_most_recent_role(self):
+    async def get_most_recent_role(self):
+        role = self._cached_role()
+        if role is not None:
+            return role
         try:
-            json_data = [
-                {
-                    'operationName': 'GetRoles',
-                    'variables': {},
-                    'query': 'query GetRoles {\n  viewer {\n    _id\n    roles {\n      ...role\n      __typename\n    }\n    yearsOfExperience {\n      newToWorkforce\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment role on Role {\n  id\n  title {\n    text\n    ontologyId\n    __typename\n  }\n  company {\n    text\n    ontologyId\n    __typename\n  }\n  seniority {\n    text\n    ontologyId\n    __typename\n  }\n  from {\n    year\n    month\n    __typename\n  }\n  to {\n    year\n    month\n    __typename\n  }\n  achievements\n  tracking {\n    events {\n      key\n      value\n      __typename\n    }\n    __typename\n  }\n  __typename\n}',
-                }
-            ]
-
-            response = self.session.post('https://www.seek.com.au/graphql', json=json_data)
-            response.raise_for_status()
-            # TODO: check response for errors as status always seems to be 200
-            data = response.json()
-            roles = data[0]['data']['viewer']['roles']
-            if roles:
-                most_recent_role = {
-                    'company': roles[0]['company']['text'] if roles[0]['company'] else '',
-                    'title': roles[0]['title']['text'] if roles[0]['title'] else '',
-                    'started': {
-                        "year": roles[0]['from']['year'] if roles[0]['from'] else '',
-                        "month": roles[0]['from']['month'] if roles[0]['from'] else '',
-                    },
-                }
-                if roles[0]['to']:
-                    most_recent_role['finished'] = {
-                        "year": roles[0]['to']['year'] if roles[0]['to'] else '',
-                        "month": roles[0]['to']['month'] if roles[0]['to'] else '',
-                    }
-                return most_recent_role
-            return {}
+            return self._cache_role(self._parse_most_recent_role(await self._graphql(self._get_roles())))
         except Exception as e:
             logging.error(f"Error fetching most recent role: {e}")
 
 
 if __name__ == "__main__":
-    mail_client = MailClient("gmail.com")
-    with SeekClient(mail_client) as seek_client:
-        seek_client.login()
-        # resume_uri = seek_client._upload_attachment('CoverLetter', "application_pipeline/application_materials/electrical resume.pdf")
-        # logging.info(f"Uploaded resume, got uri: {resume_uri}")
\ No newline at end of file
+    async def main():
+        mail_client = MailClient("gmail.com")
+        async with AsyncSeekClient(mail_client) as seek_client:
+            await seek_client.login()
+            # resume_uri = (await seek_client._upload_attachments({"CoverLetter": "application_pipeline/application_materials/electrical resume.pdf"}))["CoverLetter"]
+            # logging.info(f"Uploaded resume, got uri: {resume_uri}")
+
+    asyncio.run(main())
@@ -1,11 +1,17 @@
 
-from apify_client import ApifyClientAsync
-from dotenv import load_dotenv
+from scrapers.ufl_parser import UFPageParser, FIELD_CLASSES
+from common.utils import load_json_file, write_json_file
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timezone
 from urllib.parse import urlencode
+from dotenv import load_dotenv
+from pathlib import Path
+import hashlib
 import logging
 import asyncio
+import codecs
+import math
 import os
-import re
 
 import requests
 load_dotenv()
@@ -15,39 +21,141 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
 )
 
+# http cache entry holding when digest jobs queued by an earlier run are due to be sent
+DIGEST_DUE_KEY = "digest_due"
+
 class JobScraper:
-    def __init__(self, run_config):
+    # run_config keys used by the pipeline itself, everything else is actor input
+    PIPELINE_KEYS = {'searchTerms', 'rate_limits', 'digest', 'dataset_page_size'}
+    UFL_CHUNK_SIZE = 16384
+    # Dataset item fields the actor may use for a listing's posting time
+    LISTED_AT_KEYS = ('listedAt', 'listingDate', 'listedDate')
+
+    def __init__(self, run_config, http_cache_path=None):
         self.run_config = run_config
         self.source = run_config.get("source", "seek")
         self.client = None
+        self.http_cache_path = http_cache_path
+        self.http_cache = {}
+        self.pending_http_cache = {}
+        # Set when the UF listing is unchanged since the last committed run
+        self.unchanged = False
+        # Set when a UF listing page after the first failed, its jobs were never seen so the cache isn't committed
+        self.incomplete = False
+        # search term -> {"listed_at": newest listing time seen, "ids": ids listed at that time}
+        self.watermarks = {}
+        self._previous_watermarks = {}
+        # Search terms whose listings weren't all handled, they keep the watermark they started with
+        self.held_terms = set()
         if self.source != "ufl":
+            from apify_client import ApifyClientAsync
             self.client = ApifyClientAsync(os.getenv("APIFY_KEY"))
         
     async def scrape(self, actor=None):
         if self.source == "ufl":
-            return await asyncio.to_thread(self._scrape_ufl)
+            return await self._scrape_ufl()
+        all_data = {}
+        async for searchTerm, items in self.stream(actor):
+            all_data.setdefault(searchTerm, []).extend(items)
+        return all_data
+
+    async def stream(self, actor, watermarks=None):
+        # Yields (search term, page of items) as each actor run finishes, so callers can start on the
+        # first search term while slower runs are still going and never hold a whole dataset at once.
+        # With watermarks from an earlier run only listings newer than the watermark are yielded.
+        watermarks = watermarks or {}
+        self.watermarks = dict(watermarks)
+        self._previous_watermarks = dict(watermarks)
+        self.held_terms = set()
+        page_size = self.run_config.get("dataset_page_size", 100)
+        tasks = [
+            asyncio.create_task(self._run_actor(actor, query, watermarks.get(query)))
+            for query in self.run_config['searchTerms']
+        ]
         try:
-            all_data = {}
-            tasks = []
-            searchTerms = []
-            for query in self.run_config['searchTerms']:
-                config = {k: v for k, v in self.run_config.items() if k != 'searchTerms'}
-                config['searchTerm'] = query
-                searchTerms.append(query)
-                tasks.append(self.client.actor(actor).call(run_input=config))
-            
-            responses = await asyncio.gather(*tasks, return_exceptions=True)
-            for searchTerm, response in zip(searchTerms, responses):
-                if isinstance(response, Exception):
+            for task in asyncio.as_completed(tasks):
+                searchTerm, run = await task
+                if run is None:
                     continue
-                all_data[searchTerm] = await self._get_dataset(response)
+                found = 0
+                async for items in self._iterate_dataset(run, page_size, searchTerm, watermarks.get(searchTerm)):
+                    found += len(items)
+                    yield searchTerm, items
+                if not found:
+                    logging.info(f'No new jobs found for search term: {searchTerm}')
+        finally:
+            for task in tasks:
+                task.cancel()
 
-            return all_data
+    async def _run_actor(self, actor, query, watermark=None):
+        config = {k: v for k, v in self.run_config.items() if k not in self.PIPELINE_KEYS}
+        config['searchTerm'] = query
+        date_range = self._date_range(config.get('dateRange'), watermark)
+        if date_range is not None:
+            config['dateRange'] = date_range
+        try:
+            return query, await self.client.actor(actor).call(run_input=config)
         except Exception as e:
-            logging.error(e)
-            return []
+            logging.error(f"Actor run failed for search term {query}: {e}")
+            return query, None
+
+    def _sorted_by_listed_date(self):
+        return (self.run_config.get('sortBy') or self.run_config.get('SortBy')) == 'ListedDate'
+
+    def _listed_at(self, item):
+        for key in self.LISTED_AT_KEYS:
+            value = item.get(key)
+            if not value:
+                continue
+            try:
+                listed_at = datetime.fromisoformat(str(value))
+            except ValueError:
+                continue
+            return listed_at if listed_at.tzinfo else listed_at.replace(tzinfo=timezone.utc)
+        return None
 
-    def _scrape_ufl(self):
+    def _date_range(self, configured, watermark):
+        # Only ask the actor for the days since the newest listing seen last run, never more than configured
+        if not watermark:
+            return configured
+        days = (datetime.now(timezone.utc) - datetime.fromisoformat(watermark['listed_at'])).total_seconds() / 86400
+        days = max(1, math.ceil(days))
+        return min(configured, days) if configured else days
+
+    def _is_seen(self, item, watermark):
+        if not watermark:
+            return False
+        listed_at = self._listed_at(item)
+        if listed_at is None:
+            return False
+        mark = datetime.fromisoformat(watermark['listed_at'])
+        return listed_at < mark or (listed_at == mark and item.get('id') in watermark['ids'])
+
+    def hold_watermark(self, searchTerm):
+        # The term is read from its old watermark again next run, e.g. after a job from it failed
+        self.held_terms.add(searchTerm)
+        if searchTerm in self._previous_watermarks:
+            self.watermarks[searchTerm] = self._previous_watermarks[searchTerm]
+        else:
+            self.watermarks.pop(searchTerm, None)
+
+    def _advance_watermark(self, searchTerm, items):
+        if searchTerm in self.held_terms:
+            return
+        mark = self.watermarks.get(searchTerm)
+        for item in items:
+            listed_at = self._listed_at(item)
+            if listed_at is None:
+                continue
+            current = datetime.fromisoformat(mark['listed_at']) if mark else None
+            if current is None or listed_at > current:
+                mark = {'listed_at': listed_at.isoformat(), 'ids': [item.get('id')]}
+            elif listed_at == current and item.get('id') not in mark['ids']:
+                mark = {**mark, 'ids': mark['ids'] + [item.get('id')]}
+        if mark:
+            self.watermarks[searchTerm] = mark
+
+    def _ufl_url(self, page=1):
         filters = self.run_config.get("filters", {})
         base_url = self.run_config.get("base_url", "https://explore.jobs.ufl.edu/en-us/filter/")
         params = []
@@ -61,62 +169,167 @@ class JobScraper:
             params.append(("location", location))
         if filters.get("job_mail_subscribe_privacy"):
             params.append(("job-mail-subscribe-privacy", filters["job_mail_subscribe_privacy"]))
+        if page > 1:
+            params.append(("page", page))
 
         query_string = urlencode(params, doseq=True)
-        url = f"{base_url}?{query_string}" if query_string else base_url
-        headers = {"User-Agent": self.run_config.get("user_agent", "Mozilla/5.0")}
+        return f"{base_url}?{query_string}" if query_string else base_url
 
-        try:
-            response = requests.get(url, headers=headers, timeout=30)
+    async def _scrape_ufl(self):
+        max_parallel = self.run_config.get("max_parallel_fetches", 4)
+        max_pages = self.run_config.get("max_pages", 20)
+        limit = asyncio.Semaphore(max_parallel)
+
+        # One pooled session shared by every page and detail fetch
+        with requests.Session() as session:
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_parallel))
+            session.headers.update({"User-Agent": self.run_config.get("user_agent", "Mozilla/5.0")})
+
+            first_page = await self._fetch_ufl_first_page(session, self._ufl_url())
+            if first_page is None or self.unchanged:
+                return []
+
+            jobs = {}
+            fetched = {1}
+            known_pages = set(first_page.page_numbers)
+            for job in first_page.jobs.values():
+                jobs.setdefault(job["jobLink"], job)
+
+            # Pages link to further pages, so keep fetching until no unseen page numbers remain
+            while True:
+                pending = sorted(page for page in known_pages - fetched if page <= max_pages)
+                if not pending:
+                    break
+                fetched.update(pending)
+                pages = await asyncio.gather(*(self._fetch_ufl(session, limit, self._ufl_url(page)) for page in pending))
+                for page in pages:
+                    if page is None:
+                        self.incomplete = True
+                        continue
+                    known_pages |= page.page_numbers
+                    for job in page.jobs.values():
+                        jobs.setdefault(job["jobLink"], job)
+            logging.info(f"Found {len(jobs)} UF jobs across {len(fetched)} listing pages")
+            skipped = sorted(page for page in known_pages if page > max_pages)
+            if skipped:
+                logging.warning(f"Skipped {len(skipped)} UF listing pages past max_pages={max_pages} (up to page {skipped[-1]}), raise it in the run config to fetch them")
+
+            if self.run_config.get("fetch_details", True):
+                missing = [job for job in jobs.values() if not all(job[key] for key in FIELD_CLASSES)]
+                await asyncio.gather(*(self._fill_ufl_details(session, limit, job) for job in missing))
+
+        return list(jobs.values())
+
+    def _stream_ufl_page(self, session, url, headers=None):
+        # Runs in a worker thread, the body is parsed and hashed chunk by chunk as it arrives
+        with session.get(url, headers=headers, timeout=30, stream=True) as response:
             response.raise_for_status()
+            if response.status_code == 304:
+                return response, None, None
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+            body_hash = hashlib.sha256()
+            parser = UFPageParser()
+            for chunk in response.iter_content(chunk_size=self.UFL_CHUNK_SIZE):
+                body_hash.update(chunk)
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+            return response, parser, body_hash.hexdigest()
+
+    async def _fetch_ufl(self, session, limit, url):
+        async with limit:
+            try:
+                _, parser, _ = await asyncio.to_thread(self._stream_ufl_page, session, url)
+                return parser
+            except Exception as exc:
+                logging.error(f"Failed to fetch UF page {url}: {exc}")
+                return None
+
+    async def _fetch_ufl_first_page(self, session, url):
+        if self.http_cache_path and Path(self.http_cache_path).exists():
+            self.http_cache = load_json_file(self.http_cache_path)
+        cached = self.http_cache.get(url, {})
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            response, parser, body_hash = await asyncio.to_thread(self._stream_ufl_page, session, url, headers)
         except Exception as exc:
-            logging.error(f"Failed to fetch UF listing page: {exc}")
-            return []
-
-        return self._parse_ufl_listings(response.text)
-
-    def _parse_ufl_listings(self, html_text):
-        jobs = []
-        seen_links = set()
-        for match in re.finditer(r'<a[^>]+href="(?P<link>[^"]+)"[^>]*>(?P<title>[^<]+)</a>', html_text):
-            link = match.group("link")
-            title = match.group("title").strip()
-            if "/en-us/job/" not in link:
-                continue
-            job_id = link.rstrip("/").split("/")[-1]
-            job_link = f"https://explore.jobs.ufl.edu{link}"
-            if job_link in seen_links:
-                continue
-            seen_links.add(job_link)
-            jobs.append(
-                {
-                    "id": job_id,
-                    "title": title,
-                    "jobLink": job_link,
-                    "location": "",
-                    "category": "",
-                    "work_type": "",
-                }
-            )
-        for match in re.finditer(r'"jobLink":"(?P<link>/en-us/job/[^"]+)"', html_text):
-            link = match.group("link")
-            job_id = link.rstrip("/").split("/")[-1]
-            job_link = f"https://explore.jobs.ufl.edu{link}"
-            if job_link in seen_links:
-                continue
-            seen_links.add(job_link)
-            jobs.append(
-                {
-                    "id": job_id,
-                    "title": "",
-                    "jobLink": job_link,
-                    "location": "",
-                    "category": "",
-                    "work_type": "",
-                }
-            )
-        return jobs
-
-    async def _get_dataset(self, run):
-        data = await self.client.dataset(run["defaultDatasetId"]).list_items()
-        return data.items
+            logging.error(f"Failed to fetch UF page {url}: {exc}")
+            return None
+
+        if response.status_code == 304 or (cached and body_hash == cached.get("sha256")):
+            self.unchanged = True
+            return None
+
+        # Only committed once the pipeline has handled these jobs, so a failed run refetches
+        self.pending_http_cache[url] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": body_hash,
+        }
+        return parser
+
+    def digest_due(self):
+        # Kept in the http cache file so an unchanged run can tell a queued digest is due without opening state
+        due = self.http_cache.get(DIGEST_DUE_KEY)
+        return due is not None and datetime.fromisoformat(due) <= datetime.now()
+
+    def set_digest_due(self, due):
+        due = due.isoformat() if due else None
+        if self.http_cache.get(DIGEST_DUE_KEY) == due:
+            return
+        if due:
+            self.http_cache[DIGEST_DUE_KEY] = due
+        else:
+            self.http_cache.pop(DIGEST_DUE_KEY, None)
+        if self.http_cache_path:
+            write_json_file(self.http_cache_path, self.http_cache)
+
+    def commit_http_cache(self):
+        if not self.http_cache_path or not self.pending_http_cache:
+            return
+        if self.incomplete:
+            logging.warning("Some UF listing pages failed to fetch, the listing will be fetched again next run")
+            self.pending_http_cache = {}
+            return
+        self.http_cache.update(self.pending_http_cache)
+        write_json_file(self.http_cache_path, self.http_cache)
+        self.pending_http_cache = {}
+
+    async def _fill_ufl_details(self, session, limit, job):
+        page = await self._fetch_ufl(session, limit, job["jobLink"])
+        if page is None:
+            return
+        for key, value in page.page_fields.items():
+            if value and not job.get(key):
+                job[key] = value
+
+    async def _iterate_dataset(self, run, page_size, searchTerm=None, watermark=None):
+        dataset = self.client.dataset(run["defaultDatasetId"])
+        stop_at_seen = watermark and self._sorted_by_listed_date()
+        offset = 0
+        while True:
+            try:
+                page = await dataset.list_items(offset=offset, limit=page_size)
+            except Exception as e:
+                logging.error(f"Error reading dataset {run['defaultDatasetId']} at offset {offset}: {e}")
+                # Older listings past this page were never read, they must stay above the watermark
+                self.hold_watermark(searchTerm)
+                return
+            if not page.items:
+                return
+            items = [item for item in page.items if not self._is_seen(item, watermark)]
+            self._advance_watermark(searchTerm, items)
+            if items:
+                yield items
+            offset += len(page.items)
+            # Newest listings come first, once one was seen last run the rest of the dataset was too
+            if stop_at_seen and len(items) < len(page.items):
+                logging.info(f"Reached listings seen in an earlier run for search term: {searchTerm}, skipping the remaining {page.total - offset}")
+                return
+            if offset >= page.total:
+                return
@@ -0,0 +1,237 @@
+import bisect
+import html
+import json
+import re
+
+UFL_HOST = "https://explore.jobs.ufl.edu"
+
+# Job record field -> css class holding it on UF listing and job pages
+FIELD_CLASSES = {'location': 'location', 'category': 'categories', 'work_type': 'work-type'}
+
+# Keys used for the same fields in the job JSON embedded in the page scripts
+JSON_FIELDS = {
+    'title': ('title', 'name'),
+    'location': ('location', 'locations'),
+    'category': ('category', 'categories'),
+    'work_type': ('workType', 'work_type'),
+}
+
+# Each kind of record has its own pattern starting with a literal, which the regex engine can skip to
+# far faster than it can try an alternation at every character. Anchors are matched whole with their
+# text, which may hold other tags but never another anchor so an unclosed <a> can't swallow the next one.
+ANCHOR_PATTERN = re.compile(r'<[aA]\s(?P<attrs>[^>]*)>(?P<title>[^<]*(?:<(?!/?[aA][\s>])[^<]*)*)</[aA]\s*>')
+FIELD_CLASS_NAMES = r'(?:location|categories|work-type)(?=[\s"\'])'
+# A field element whose text runs straight into a closing tag is read here, the closing tag can only be its own.
+# Attribute names are matched in lowercase as UF pages write them, a case insensitive 'class' is several times slower.
+FIELD_CLASS_PATTERN = re.compile(
+    r'class\s*=\s*["\'](?P<classes>' + FIELD_CLASS_NAMES + r'[^"\'>]*|[^"\'>]*\s' + FIELD_CLASS_NAMES + r'[^"\'>]*)["\'][^>]*>'
+    r'(?P<value>[^<]*)(?:</(?P<close>[a-zA-Z][a-zA-Z0-9]*))?'
+)
+JSON_LINK_PATTERN = re.compile(r'"jobLink"\s*:\s*"(?P<link>/en-us/job/[^"]+)"')
+TAG_NAME_PATTERN = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)\s')
+STRIP_TAGS_PATTERN = re.compile(r'<[^>]*>')
+HREF_PATTERN = re.compile(r'\bhref\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+PAGE_PATTERN = re.compile(r'[?&](?:amp;)?page=(\d+)')
+# Open and close tags of each field element's tag name, filled in as tag names are seen
+FIELD_TAG_PATTERNS = {}
+
+
+def new_job(link, title=""):
+    return {
+        "id": link.rstrip("/").split("/")[-1],
+        "title": title,
+        "jobLink": f"{UFL_HOST}{link}",
+        "location": "",
+        "category": "",
+        "work_type": "",
+    }
+
+
+def _field_tag_pattern(tag):
+    tag = tag.lower()
+    pattern = FIELD_TAG_PATTERNS.get(tag)
+    if pattern is None:
+        # Case insensitive on the name only, so the regex engine can still skip ahead to each '<'
+        pattern = FIELD_TAG_PATTERNS[tag] = re.compile(rf'<(/?)(?i:{tag})\b[^>]*>')
+    return pattern
+
+
+class UFPageParser:
+    # Parses a UF page fed in arbitrary chunks without holding the whole body. Collects job anchors
+    # with the location/category/work type elements that follow them, jobs from embedded "jobLink"
+    # JSON, pagination page numbers and, for job detail pages, fields seen before any job anchor.
+    # Only the last OVERLAP characters are kept between chunks in case a record continues in the next
+    # one, records in that overlap are read again with the next chunk, which is harmless as jobs merge.
+    OVERLAP = 8192
+
+    def __init__(self):
+        self.jobs = {}
+        self.page_numbers = set()
+        self.page_fields = {}
+        self._buffer = ""
+        self._current_job = None
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if len(self._buffer) > 2 * self.OVERLAP:
+            self._process(final=False)
+
+    def close(self):
+        self._process(final=True)
+        self._buffer = ""
+
+    def _process(self, final):
+        text = self._buffer
+        # Records starting before the limit are complete unless longer than OVERLAP. When the limit
+        # falls inside a tag the kept text starts at that tag, so a class attribute keeps its tag name.
+        limit = len(text) if final else len(text) - self.OVERLAP
+        cut = limit
+        tag_start = text.rfind("<", 0, limit)
+        if not final and tag_start != -1 and text.find(">", tag_start, limit) == -1:
+            cut = tag_start
+
+        # Fields belong to the last job anchor before them
+        positions = []
+        jobs = []
+        for match in ANCHOR_PATTERN.finditer(text):
+            if match.start() >= limit:
+                break
+            job = self._handle_anchor(match)
+            if job is not None:
+                positions.append(match.start())
+                jobs.append(job)
+
+        for match in FIELD_CLASS_PATTERN.finditer(text):
+            if match.start() >= limit:
+                break
+            if not text[match.start() - 1].isspace():
+                continue
+            index = bisect.bisect(positions, match.start())
+            current_job = jobs[index - 1] if index else self._current_job
+            close = match.group("close")
+            if close is not None:
+                # Anchors are job links, a field class on one doesn't make it a field
+                if close.lower() != "a":
+                    self._set_fields(current_job, match.group("classes"), match.group("value"))
+            elif not self._handle_field(text, match, current_job, final):
+                cut = min(cut, text.rfind("<", 0, match.start()))
+
+        for match in JSON_LINK_PATTERN.finditer(text):
+            if match.start() >= limit:
+                break
+            if not self._handle_json(text, match, final):
+                cut = min(cut, match.start())
+
+        index = bisect.bisect_left(positions, cut)
+        if index:
+            self._current_job = jobs[index - 1]
+        self._buffer = text[cut:]
+
+    def _handle_anchor(self, match):
+        attrs = match.group("attrs")
+        if "/en-us/job/" not in attrs and "page=" not in attrs:
+            return None
+        href = HREF_PATTERN.search(attrs)
+        href = href.group(1) if href else ""
+        if "&" in href:
+            href = html.unescape(href)
+        if "/en-us/job/" in href:
+            return self._add_job(new_job(href.split(UFL_HOST, 1)[-1], self._text(match.group("title"))))
+        page = PAGE_PATTERN.search(href)
+        if page:
+            self.page_numbers.add(int(page.group(1)))
+        return None
+
+    def _handle_field(self, text, match, current_job, final):
+        # Returns False when the field's closing tag isn't buffered yet
+        start = text.rfind("<", 0, match.start())
+        tag = TAG_NAME_PATTERN.match(text, start) if start != -1 else None
+        if tag is None or tag.group(1).lower() == "a" or text.find(">", start, match.start()) != -1:
+            return True
+        # Nested elements of the same tag are counted so the field ends at its own closing tag
+        depth = 1
+        end = None
+        content_start = match.start("value")
+        for tag_match in _field_tag_pattern(tag.group(1)).finditer(text, content_start):
+            depth += -1 if tag_match.group(1) else 1
+            if depth == 0:
+                end = tag_match.start()
+                break
+        if end is None:
+            if not final:
+                return False
+            end = len(text)
+        self._set_fields(current_job, match.group("classes"), text[content_start:end])
+        return True
+
+    def _handle_json(self, text, match, final):
+        # Fields come from the flat object around the link, nested objects only give the link
+        job = new_job(match.group("link"))
+        existing = self.jobs.get(job["jobLink"])
+        if existing is not None and all(existing[key] for key in JSON_FIELDS):
+            # Usually the listing rows already gave every field, the JSON only repeats them
+            return True
+        end = text.find("}", match.end())
+        if end == -1 and not final:
+            return False
+        start = text.rfind("{", 0, match.start())
+        flat = (
+            end != -1 and start != -1
+            and text.rfind("}", start, match.start()) == -1
+            and text.find("{", match.end(), end) == -1
+        )
+        if flat:
+            try:
+                data = json.loads(text[start:end + 1])
+            except json.JSONDecodeError:
+                data = {}
+            for key, names in JSON_FIELDS.items():
+                for name in names:
+                    value = data.get(name)
+                    if isinstance(value, list):
+                        value = ", ".join(str(item) for item in value)
+                    if value:
+                        job[key] = str(value).strip()
+                        break
+        self._add_job(job)
+        return True
+
+    def _text(self, value):
+        if "<" in value:
+            value = STRIP_TAGS_PATTERN.sub(" ", value)
+        if "&" in value:
+            value = html.unescape(value)
+        return " ".join(value.split())
+
+    def _add_job(self, job):
+        existing = self.jobs.get(job["jobLink"])
+        if existing is None:
+            self.jobs[job["jobLink"]] = job
+            return job
+        for key, value in job.items():
+            if value and not existing[key]:
+                existing[key] = value
+        return existing
+
+    def _set_fields(self, job, classes, value):
+        classes = classes.split()
+        for key, css_class in FIELD_CLASSES.items():
+            if css_class in classes:
+                self._set_field(job, key, self._text(value))
+                return
+
+    def _set_field(self, job, key, value):
+        if not value:
+            return
+        if job is None:
+            self.page_fields.setdefault(key, value)
+        elif not job[key]:
+            job[key] = value
+
+
+def parse_ufl_page(chunks):
+    parser = UFPageParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser